@@ -1,13 +1,47 @@
 import os
-import git
-import autopep8
-import jsbeautifier
+import re
+import sys
+import queue
+import bisect
+import json
+import codecs
+import copy
+import cProfile
+import hashlib
+import importlib
+import itertools
+import multiprocessing
+import importlib.metadata
 import tempfile
 import subprocess
-from flask import Flask, render_template, request, jsonify
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, CancelledError, Future, ThreadPoolExecutor, as_completed, TimeoutError as FormatTimeoutError, wait as wait_futures
+from contextlib import contextmanager
+from flask import Flask, Response, g, has_request_context, render_template, request, jsonify
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None # Optional: faster content hashing for /api/compare
+
 
 app = Flask(__name__)
 
+# GitPython and the formatters are imported on first use, so instances that
+# only serve the explorer never load them
+def _git():
+    return importlib.import_module('git')
+
+def _optional_module(name):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
 STATIC_EXTENSIONS = {
     '.png', '.jpg', '.jpeg', '.gif', '.ico', '.svg', '.woff', '.woff2', 
     '.ttf', '.eot', '.mp4', '.webm', '.mp3', '.wav', '.pdf', '.zip', 
@@ -18,114 +52,1444 @@ def is_static_file(filename):
     ext = os.path.splitext(filename)[1].lower()
     return ext in STATIC_EXTENSIONS
 
+# Pool of open git.Repo handles keyed by absolute repo path. A handle is only
+# used by one request thread at a time; idle handles are returned to the pool
+# so the next request skips re-opening the repository. Each idle handle keeps
+# its git child processes alive, so the pool is an LRU over repo paths capped
+# at REPO_POOL_MAX_TOTAL idle handles overall; evicted handles are closed.
+REPO_POOL_MAX_IDLE = 4
+REPO_POOL_MAX_TOTAL = int(os.environ.get('REPO_POOL_MAX_TOTAL', 16))
+_repo_pool = OrderedDict()
+_repo_pool_lock = threading.Lock()
+
+# LRU index of commit diffs keyed by (repo path, commit sha). Each entry maps a
+# changed path to its diff metadata so single-file lookups are O(1).
+DIFF_INDEX_MAX_COMMITS = 64
+_diff_index = OrderedDict()
+_diff_index_lock = threading.Lock()
+
+cache_stats = {
+    'repo_pool_hits': 0,
+    'repo_pool_misses': 0,
+    'diff_index_hits': 0,
+    'diff_index_misses': 0,
+}
+
+# Timing spans for the hot paths. Each span name (plus labels) keeps a count,
+# total seconds, a latency histogram and bytes processed; /metrics exposes
+# them in Prometheus text format. With SERVER_TIMING=1 the spans recorded on
+# the request thread are also returned in a Server-Timing header.
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+# Requests slower than this are profiled with cProfile and dumped to
+# PROFILE_DIR as <endpoint>-<timestamp>.prof; 0 disables profiling
+PROFILE_THRESHOLD_MS = float(os.environ.get('PROFILE_THRESHOLD_MS', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'text-compare-profiles'))
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+def record_span(name, seconds, nbytes=0, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        metric = _metrics.get(key)
+        if metric is None:
+            metric = _metrics[key] = {'count': 0, 'seconds': 0.0, 'bytes': 0, 'buckets': [0] * len(METRICS_BUCKETS)}
+        metric['count'] += 1
+        metric['seconds'] += seconds
+        metric['bytes'] += nbytes
+        i = bisect.bisect_left(METRICS_BUCKETS, seconds)
+        if i < len(METRICS_BUCKETS):
+            metric['buckets'][i] += 1
+    if SERVER_TIMING and has_request_context():
+        timings = g.setdefault('timings', {})
+        timings[name] = timings.get(name, 0.0) + seconds
+
+@contextmanager
+def span(name, **labels):
+    # Times the block; set info['bytes'] to record the bytes it processed
+    info = {'bytes': 0}
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        record_span(name, time.perf_counter() - start, info['bytes'], **labels)
+
+@app.before_request
+def _start_request_timing():
+    g.request_start = time.perf_counter()
+    if PROFILE_THRESHOLD_MS > 0:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def _finish_request_timing(response):
+    # Streamed bodies are produced after this hook, so for NDJSON/SSE
+    # responses the span covers setup only
+    elapsed = time.perf_counter() - g.request_start
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        if elapsed * 1000 >= PROFILE_THRESHOLD_MS:
+            try:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                profiler.dump_stats(os.path.join(PROFILE_DIR, f"{request.endpoint or 'unknown'}-{time.time_ns()}.prof"))
+            except OSError as e:
+                print(f"Error writing profile: {e}")
+
+    if SERVER_TIMING:
+        # Durations are summed per span name, so concurrent work (e.g. both
+        # sides of a diff formatting in parallel) can add up to more than total
+        timings = g.get('timings', {})
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+        entries.append(f"total;dur={elapsed * 1000:.1f}")
+        response.headers['Server-Timing'] = ', '.join(entries)
+    record_span('request', elapsed, response.content_length or 0, endpoint=request.endpoint or 'unknown')
+    return response
+
+# Object access backends. Blob reads and tree diffs go through repo.backend;
+# GitPython is still used for resolving revisions and building patches.
+# REPO_BACKEND: 'auto' (pygit2 if installed, else cat-file), 'pygit2',
+# 'catfile' or 'gitpython'. pygit2 is optional.
+REPO_BACKEND = os.environ.get('REPO_BACKEND', 'auto')
+
+class GitPythonBackend:
+    name = 'gitpython'
+
+    def __init__(self, repo):
+        self.repo = repo
+
+    def size(self, hexsha):
+        return self.repo.odb.info(bytes.fromhex(hexsha)).size
+
+    def read(self, hexsha):
+        return self.repo.odb.stream(bytes.fromhex(hexsha)).read()
+
+    def diff_tree(self, *args):
+        return self.repo.git.diff_tree(*args, strip_newline_in_stdout=False).encode('utf-8', 'surrogateescape')
+
+    def close(self):
+        pass
+
+class CatFileBackend(GitPythonBackend):
+    # Long-lived `git cat-file --batch` / `--batch-check` processes per repo
+    # handle, so a blob read is one request/response on an open pipe
+    name = 'catfile'
+
+    def __init__(self, repo):
+        super().__init__(repo)
+        self.lock = threading.Lock()
+        self.procs = {}
+
+    def _query(self, mode, hexsha):
+        proc = self.procs.get(mode)
+        if proc is None or proc.poll() is not None:
+            proc = self.procs[mode] = subprocess.Popen(['git', 'cat-file', mode], cwd=self.repo.working_dir,
+                                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        proc.stdin.write(hexsha.encode('ascii') + b'\n')
+        proc.stdin.flush()
+        header = proc.stdout.readline().split()
+        if len(header) != 3:
+            raise ValueError(f'Object {hexsha} not found')
+        return proc, int(header[2])
+
+    def _call(self, mode, hexsha, read):
+        with self.lock:
+            try:
+                proc, size = self._query(mode, hexsha)
+                if not read:
+                    return size
+                data = proc.stdout.read(size)
+                proc.stdout.read(1) # Trailing newline
+                return data
+            except OSError:
+                # Broken pipe: drop the process, the next call starts a new one
+                self._stop(mode)
+                raise
+
+    def size(self, hexsha):
+        return self._call('--batch-check', hexsha, False)
+
+    def read(self, hexsha):
+        return self._call('--batch', hexsha, True)
+
+    def diff_tree(self, *args):
+        # diff-tree output is not self-delimiting, so each (uncached) listing
+        # is its own process; the raw bytes are parsed without a text decode
+        proc = subprocess.run(['git', 'diff-tree', *args], cwd=self.repo.working_dir, capture_output=True)
+        if proc.returncode != 0:
+            raise _git().GitCommandError(['git', 'diff-tree', *args], proc.returncode, proc.stderr)
+        return proc.stdout
+
+    def _stop(self, mode):
+        proc = self.procs.pop(mode, None)
+        if proc is not None:
+            proc.kill()
+            proc.wait()
+            proc.stdin.close()
+            proc.stdout.close()
+
+    def close(self):
+        with self.lock:
+            for mode in list(self.procs):
+                self._stop(mode)
+
+class Pygit2Backend(CatFileBackend):
+    # Objects are read in-process through libgit2; tree diffs still use the
+    # git CLI so rename detection matches `git diff-tree` exactly
+    name = 'pygit2'
+
+    def __init__(self, repo):
+        super().__init__(repo)
+        self.odb = _optional_module('pygit2').Repository(repo.git_dir)
+
+    def size(self, hexsha):
+        with self.lock:
+            return self.odb[hexsha].size
+
+    def read(self, hexsha):
+        with self.lock:
+            return self.odb[hexsha].data
+
+def make_backend(repo):
+    name = REPO_BACKEND
+    has_pygit2 = name in ('auto', 'pygit2') and _optional_module('pygit2') is not None
+    if name == 'auto':
+        name = 'pygit2' if has_pygit2 else 'catfile'
+    if name == 'pygit2' and has_pygit2:
+        return Pygit2Backend(repo)
+    if name in ('catfile', 'pygit2'):
+        return CatFileBackend(repo)
+    return GitPythonBackend(repo)
+
+def _close_repo(repo):
+    repo.backend.close()
+    repo.close()
+
+def _repo_key(repo_path):
+    return os.path.normcase(os.path.abspath(repo_path))
+
+@contextmanager
+def repo_handle(repo_path):
+    key = _repo_key(repo_path)
+    repo = None
+    with _repo_pool_lock:
+        idle = _repo_pool.get(key)
+        if idle:
+            repo = idle.pop()
+            if not idle:
+                del _repo_pool[key]
+            cache_stats['repo_pool_hits'] += 1
+        else:
+            cache_stats['repo_pool_misses'] += 1
+    if repo is None:
+        repo = _git().Repo(repo_path)
+        repo.backend = make_backend(repo)
+    try:
+        yield repo
+    finally:
+        evicted = [repo]
+        with _repo_pool_lock:
+            idle = _repo_pool.setdefault(key, [])
+            _repo_pool.move_to_end(key)
+            if len(idle) < REPO_POOL_MAX_IDLE:
+                idle.append(repo)
+                evicted = []
+            # Close handles of the least recently used repos past the global cap
+            while sum(len(handles) for handles in _repo_pool.values()) > REPO_POOL_MAX_TOTAL:
+                oldest_key, handles = next(iter(_repo_pool.items()))
+                evicted.append(handles.pop(0))
+                if not handles:
+                    del _repo_pool[oldest_key]
+            if not idle:
+                _repo_pool.pop(key, None)
+        for handle in evicted:
+            _close_repo(handle)
+
+# Rename detection for tree diffs. Large vendored updates can make git's
+# rename matrix expensive, so the threshold and the candidate limit are exposed
+# per request.
+DIFF_RENAME_THRESHOLD = 50 # Percent similarity, git's default
+DIFF_RENAME_LIMIT = 1000
+NULL_SHA = '0' * 40
+
+def _parse_raw_diff(output):
+    # Parses `git diff-tree -r -z --raw` output (bytes) into diff index
+    # entries. Only the fields that are kept get decoded.
+    fields = output.split(b'\0')
+    entries = []
+    i = 0
+    while i < len(fields) - 1:
+        meta = fields[i]
+        if not meta.startswith(b':'):
+            i += 1
+            continue
+        _, _, a_sha, b_sha, status = meta[1:].decode('ascii').split(' ')
+        change_type = status[0]
+        if change_type in ('R', 'C'):
+            a_path = fields[i + 1].decode('utf-8', 'surrogateescape')
+            b_path = fields[i + 2].decode('utf-8', 'surrogateescape')
+            i += 3
+        else:
+            a_path = b_path = fields[i + 1].decode('utf-8', 'surrogateescape')
+            i += 2
+        entries.append({
+            'a_path': a_path,
+            'b_path': b_path,
+            'change_type': change_type, # 'A', 'D', 'M', 'R', 'C', 'T'
+            'a_sha': None if a_sha == NULL_SHA else a_sha,
+            'b_sha': None if b_sha == NULL_SHA else b_sha,
+        })
+    return entries
+
+def _diff_index_key(repo, base, head, rename_threshold=None, rename_limit=None, pathspecs=(), diff_filter=None):
+    rename_threshold = DIFF_RENAME_THRESHOLD if rename_threshold is None else int(rename_threshold)
+    rename_limit = DIFF_RENAME_LIMIT if rename_limit is None else int(rename_limit)
+    base_sha = base.hexsha if base is not None else None
+    return (_repo_key(repo.working_dir), base_sha, head.hexsha, rename_threshold, rename_limit,
+            tuple(pathspecs), diff_filter)
+
+def get_diff_index(repo, base, head, rename_threshold=None, rename_limit=None, pathspecs=(), diff_filter=None):
+    # Path -> diff entry for base..head (base None: diff against the empty
+    # tree). The tree diff runs once per (base, head, rename options,
+    # filters). pathspecs and diff_filter are passed to git so filtered-out
+    # files are never walked or parsed.
+    key = _diff_index_key(repo, base, head, rename_threshold, rename_limit, pathspecs, diff_filter)
+    _, base_sha, head_sha, rename_threshold, rename_limit, _, _ = key
+    with _diff_index_lock:
+        index = _diff_index.get(key)
+        if index is not None:
+            _diff_index.move_to_end(key)
+            cache_stats['diff_index_hits'] += 1
+            return index
+        cache_stats['diff_index_misses'] += 1
+
+    args = ['-r', '-z', '--raw', '--no-commit-id', f'-M{rename_threshold}%', f'-l{rename_limit}']
+    if diff_filter:
+        args.append(f'--diff-filter={diff_filter}')
+    if base_sha:
+        args.extend([base_sha, head_sha])
+    else:
+        # Initial commit: compare with empty tree
+        args.extend(['--root', head_sha])
+    if pathspecs:
+        args.append('--')
+        args.extend(pathspecs)
+    with span('diff_tree') as info:
+        output = repo.backend.diff_tree(*args)
+        info['bytes'] = len(output)
+
+    # Insertion order follows the diff order so listings stay stable
+    index = OrderedDict()
+    for entry in _parse_raw_diff(output):
+        # a_path is old, b_path is new
+        path = entry['b_path'] if entry['b_path'] else entry['a_path']
+        path = path.replace('\\', '/')
+        entry['path'] = path
+        index[path] = entry
+
+    with _diff_index_lock:
+        _diff_index[key] = index
+        _diff_index.move_to_end(key)
+        while len(_diff_index) > DIFF_INDEX_MAX_COMMITS:
+            _diff_index.popitem(last=False)
+    return index
+
+def resolve_diff_range(repo, commit_id, base_id=None, parent=0, merge_base=False):
+    # Returns (base, head) commits. commit_id may be a single commit (diffed
+    # against parent number `parent`, or against base_id when given), 'A..B'
+    # or 'A...B' (from the merge base of A and B). merge_base=True replaces
+    # the base with merge-base(base, head).
+    if '...' in commit_id:
+        left, right = commit_id.split('...', 1)
+        base = repo.commit(left or 'HEAD')
+        head = repo.commit(right or 'HEAD')
+        merge_base = True
+    elif '..' in commit_id:
+        left, right = commit_id.split('..', 1)
+        base = repo.commit(left or 'HEAD')
+        head = repo.commit(right or 'HEAD')
+    else:
+        head = repo.commit(commit_id)
+        if base_id:
+            base = repo.commit(base_id)
+        elif head.parents:
+            parent = int(parent or 0)
+            if parent < 0 or parent >= len(head.parents):
+                raise ValueError(f'Commit has no parent #{parent + 1}')
+            base = head.parents[parent]
+        else:
+            base = None
+
+    if merge_base and base is not None:
+        bases = repo.merge_base(base, head)
+        base = bases[0] if bases else None
+    return base, head
+
+def get_request_diff_index(repo, data, filtered=False):
+    # Diff index for the range described by a request's commit_id, base,
+    # parent, merge_base, rename_threshold and rename_limit fields. With
+    # filtered=True the listing filters (see diff_walk_filters) apply too.
+    # Returns (index, base, head, key), key being the index's cache key.
+    base, head = resolve_diff_range(repo, data.get('commit_id'), data.get('base'),
+                                    data.get('parent', 0), data.get('merge_base', False))
+    pathspecs, diff_filter = diff_walk_filters(data) if filtered else ((), None)
+    key = _diff_index_key(repo, base, head, data.get('rename_threshold'), data.get('rename_limit'),
+                          pathspecs, diff_filter)
+    index = get_diff_index(repo, base, head, data.get('rename_threshold'), data.get('rename_limit'),
+                           pathspecs, diff_filter)
+    return index, base, head, key
+
+DIFF_CHANGE_TYPES = set('ACDMRT')
+
+def _filter_list(value):
+    # Accepts a list or a comma separated string
+    if isinstance(value, str):
+        value = value.split(',')
+    return [v.strip() for v in value or [] if v.strip()]
+
+def diff_walk_filters(data):
+    # Listing filters as git pathspecs and a --diff-filter value:
+    # 'globs' (a pattern without '/' matches the file name at any depth),
+    # 'extensions', 'change_types', and static assets unless include_static.
+    # Globs and extensions are alternatives: a file matching any is listed.
+    pathspecs = []
+    for pattern in _filter_list(data.get('globs')):
+        if '/' not in pattern:
+            pattern = '**/' + pattern
+        pathspecs.append(f':(glob){pattern.lstrip("/")}')
+    for ext in _filter_list(data.get('extensions')):
+        pathspecs.append(f':(glob,icase)**/*.{ext.lstrip(".")}')
+    if not data.get('include_static', False):
+        pathspecs.extend(f':(exclude,glob,icase)**/*{ext}' for ext in sorted(STATIC_EXTENSIONS))
+    change_types = ''.join(sorted({c.upper() for c in _filter_list(data.get('change_types'))}))
+    if set(change_types) - DIFF_CHANGE_TYPES:
+        raise ValueError(f'Unknown change type in {change_types!r}')
+    return pathspecs, change_types or None
+
+def read_blob(repo, hexsha):
+    return repo.backend.read(hexsha)
+
+# Blob reading limits. Blobs larger than BLOB_MAX_BYTES are returned as a
+# line-aligned window with 'next_offset' pointing at the next page.
+BLOB_MAX_BYTES = int(os.environ.get('BLOB_MAX_BYTES', 2 * 1024 * 1024))
+BLOB_SNIFF_BYTES = 8192
+BLOB_READ_CHUNK = 64 * 1024
+BINARY_PLACEHOLDER = "<Binary or Non-UTF8 Content>"
+
+def sniff_encoding(head):
+    # Returns the codec for a blob from its first bytes, or None for binary
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    # Explicit endianness: pages after the first have no BOM to go by
+    if head.startswith(codecs.BOM_UTF16_LE):
+        return 'utf-16-le'
+    if head.startswith(codecs.BOM_UTF16_BE):
+        return 'utf-16-be'
+    if b'\0' in head:
+        return None
+    return 'utf-8'
+
+# '\n' in the multi-byte codecs sniff_encoding returns; a match only counts
+# when it is aligned to the code unit
+_WIDE_NEWLINES = {'utf-16-le': b'\n\0', 'utf-16-be': b'\0\n'}
+
+def make_blob_view(window, size, offset=0, encoding='utf-8'):
+    truncated = encoding is not None and offset + len(window) < size
+    if truncated:
+        # Cut at the last full line so pages never split a line or a character
+        newline = _WIDE_NEWLINES.get(encoding, b'\n')
+        cut = window.rfind(newline)
+        while cut > 0 and cut % len(newline):
+            cut = window.rfind(newline, 0, cut + len(newline) - 1)
+        if cut >= 0:
+            window = window[:cut + len(newline)]
+        else:
+            # One long line: back off to the last complete character
+            decoder = codecs.getincrementaldecoder(encoding)()
+            try:
+                decoder.decode(window, final=False)
+                window = window[:len(window) - len(decoder.getstate()[0])]
+            except UnicodeDecodeError:
+                pass # Not text after all; reported as binary below
+    content = BINARY_PLACEHOLDER
+    if encoding is not None:
+        try:
+            content = window.decode(encoding)
+        except UnicodeDecodeError:
+            encoding = None
+            truncated = False
+        else:
+            if offset == 0 and encoding in _WIDE_NEWLINES:
+                content = content.removeprefix('\ufeff')
+    return {
+        'content': content,
+        'size': size,
+        'binary': encoding is None,
+        'truncated': truncated,
+        'offset': offset,
+        'next_offset': offset + len(window) if truncated else None,
+    }
+
+def read_blob_view(repo, hexsha, offset=0, limit=None):
+    limit = BLOB_MAX_BYTES if limit is None else limit
+    size = repo.backend.size(hexsha)
+    if offset == 0 and size <= limit:
+        with span('blob_read', backend=repo.backend.name) as info:
+            data = repo.backend.read(hexsha)
+            info['bytes'] = len(data)
+        return make_blob_view(data, size, 0, sniff_encoding(data[:BLOB_SNIFF_BYTES]))
+
+    # Large blob: stream it through a dedicated process and stop reading once
+    # the requested window is filled, so memory stays bounded by `limit`
+    start = time.perf_counter()
+    proc = subprocess.Popen(['git', 'cat-file', 'blob', hexsha], cwd=repo.working_dir,
+                            stdout=subprocess.PIPE)
+    try:
+        chunk = proc.stdout.read(min(BLOB_SNIFF_BYTES, size))
+        encoding = sniff_encoding(chunk)
+        if encoding is None:
+            return make_blob_view(b'', size, offset, None)
+        if encoding in _WIDE_NEWLINES:
+            offset -= offset % 2 # Keep pages on UTF-16 code unit boundaries
+        pos = 0 # Blob offset of chunk[0]
+        while chunk and pos + len(chunk) <= offset:
+            pos += len(chunk)
+            chunk = proc.stdout.read(BLOB_READ_CHUNK)
+        window = bytearray()
+        while chunk:
+            window += chunk[max(0, offset - pos):]
+            pos += len(chunk)
+            if len(window) >= limit:
+                break
+            chunk = proc.stdout.read(BLOB_READ_CHUNK)
+        record_span('blob_read_window', time.perf_counter() - start, len(window))
+        return make_blob_view(bytes(window[:limit]), size, offset, encoding)
+    finally:
+        proc.stdout.close()
+        proc.kill()
+        proc.wait()
+
+def iter_blobs_batch(repo, hexshas, max_bytes=None):
+    # Read many blobs through one `git cat-file --batch` process. Requests are
+    # written from a helper thread so git never blocks on a full stdout pipe.
+    # Yields (hexsha, blob view); at most max_bytes of each blob are kept.
+    max_bytes = BLOB_MAX_BYTES if max_bytes is None else max_bytes
+    proc = subprocess.Popen(['git', 'cat-file', '--batch'], cwd=repo.working_dir,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def feed():
+        try:
+            for hexsha in hexshas:
+                proc.stdin.write(hexsha.encode('ascii') + b'\n')
+            proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        for hexsha in hexshas:
+            header = proc.stdout.readline().split()
+            if len(header) != 3:
+                # "<sha> missing" or a truncated stream
+                yield hexsha, None
+                continue
+            size = int(header[2])
+            data = proc.stdout.read(min(size, max_bytes))
+            # Drain the rest of an oversized blob without buffering it
+            remaining = size - len(data)
+            while remaining > 0:
+                chunk = proc.stdout.read(min(remaining, BLOB_READ_CHUNK))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+            proc.stdout.read(1) # Trailing newline
+            yield hexsha, make_blob_view(data, size, 0, sniff_encoding(data[:BLOB_SNIFF_BYTES]))
+    finally:
+        proc.stdout.close()
+        proc.kill()
+        proc.wait()
+        feeder.join()
+
+_TEMPLATE_EXPR_START = '${'
+_TEMPLATE_EXPR_WHITESPACE = re.compile(r'\s*')
+# Characters that matter while scanning an expression outside / inside strings
+_TEMPLATE_EXPR_TOKEN = re.compile(r'[{}"\'`]')
+_TEMPLATE_STRING_TOKEN = {
+    quote: re.compile(r'\\+|' + quote) for quote in ('"', "'", '`')
+}
+
 def normalize_template_literals(content):
+    # Strip whitespace just inside every ${ ... } expression. Text outside the
+    # expressions is copied as slices and the scanner only stops on braces,
+    # quotes and backslashes, so the cost is linear in the input size.
     result = []
     i = 0
     n = len(content)
     while i < n:
-        if content[i:i+2] == '${':
-            result.append('${')
-            i += 2
-            # Skip initial whitespace
-            while i < n and content[i].isspace():
-                i += 1
-            
-            # Now capture until matching brace
-            start_expr = i
-            brace_count = 1
-            in_string = False
-            string_char = None
-            
-            # Safe guard against infinite loop or out of bound
-            while i < n and brace_count > 0:
-                char = content[i]
-                
-                if in_string:
-                    if char == string_char:
-                        # Check for escape
-                        escaped = False
-                        k = i - 1
-                        while k >= start_expr and content[k] == '\\':
-                            escaped = not escaped
-                            k -= 1
-                        if not escaped:
-                            in_string = False
-                else:
-                    if char == '"' or char == "'" or char == '`':
-                        in_string = True
-                        string_char = char
-                    elif char == '{':
-                        brace_count += 1
-                    elif char == '}':
-                        brace_count -= 1
-                        if brace_count == 0:
-                            # Found the closing brace
-                            # Extract expression
-                            expr = content[start_expr:i]
-                            # Trim trailing whitespace from expression
-                            expr = expr.rstrip()
-                            result.append(expr)
-                            result.append('}')
-                            i += 1
-                            break
-                i += 1
-            
-            # If loop finished without brace_count == 0, it means unclosed brace
-            if brace_count > 0:
-                 # Just append the rest if structure is invalid
-                 pass
-        else:
-            result.append(content[i])
-            i += 1
+        start = content.find(_TEMPLATE_EXPR_START, i)
+        if start < 0:
+            result.append(content[i:])
+            break
+        result.append(content[i:start + 2])
+
+        # Skip initial whitespace
+        start_expr = _TEMPLATE_EXPR_WHITESPACE.match(content, start + 2).end()
+
+        # Now capture until matching brace
+        i = start_expr
+        brace_count = 1
+        while True:
+            m = _TEMPLATE_EXPR_TOKEN.search(content, i)
+            if m is None:
+                break
+            char = m.group()
+            i = m.end()
+            if char == '{':
+                brace_count += 1
+            elif char == '}':
+                brace_count -= 1
+                if brace_count == 0:
+                    break
+            else:
+                # Skip over the string. An odd run of backslashes escapes the
+                # character that follows it.
+                string_token = _TEMPLATE_STRING_TOKEN[char]
+                while True:
+                    m = string_token.search(content, i)
+                    if m is None:
+                        i = n
+                        break
+                    i = m.end()
+                    if m.group() == char:
+                        break
+                    if (i - m.start()) % 2:
+                        i += 1
+
+        if brace_count > 0:
+            # Unclosed brace: the dangling expression is dropped
+            break
+        # Trim trailing whitespace from expression
+        result.append(content[start_expr:i - 1].rstrip())
+        result.append('}')
     return "".join(result)
 
-def format_code(content, filename, ignore_newline=False):
+# jsbeautifier mangles TypeScript generics and optional fields and SCSS
+# variables and nesting, so .ts/.tsx only get their template literals
+# normalized and .scss is shown as is unless a FORMAT_DAEMONS entry claims them
+JS_BEAUTIFY_EXTENSIONS = {'.js', '.jsx', '.json', '.css', '.html'}
+
+# Formatted output cache keyed by (blob sha, formatter, options, formatter
+# version). The memory tier is always on; the disk tier is enabled by pointing
+# FORMAT_CACHE_DIR at a writable directory.
+FORMAT_CACHE_VERSION = 1
+FORMAT_CACHE_MEMORY_MAX_BYTES = 64 * 1024 * 1024
+FORMAT_CACHE_DIR = os.environ.get('FORMAT_CACHE_DIR')
+FORMAT_CACHE_DISK_MAX_BYTES = int(os.environ.get('FORMAT_CACHE_DISK_MAX_BYTES', 512 * 1024 * 1024))
+_format_cache = OrderedDict()
+_format_cache_bytes = 0
+_format_cache_disk_bytes = None # Computed lazily on first disk write
+_format_cache_lock = threading.Lock()
+
+cache_stats.update({
+    'format_cache_hits': 0,
+    'format_cache_disk_hits': 0,
+    'format_cache_misses': 0,
+})
+
+def get_formatter_name(ext):
+    return _formatter_for_ext.get(ext)
+
+def get_formatter_version(name):
+    # Read from package metadata so cache lookups don't import the formatter
+    version = _formatter_versions.get(name) or FORMATTERS[name].get('version')
+    if version is None:
+        module_name = FORMATTERS[name]['module']
+        try:
+            version = importlib.metadata.version(module_name)
+        except importlib.metadata.PackageNotFoundError:
+            # Standard library formatters follow the Python version
+            version = getattr(importlib.import_module(module_name), '__version__', sys.version.split()[0])
+        _formatter_versions[name] = version
+    return version
+
+def format_cache_key(blob_sha, ext, ignore_newline):
+    formatter = get_formatter_name(ext)
+    version = get_formatter_version(formatter)
+    fingerprint = f"{ext}:{int(bool(ignore_newline))}:v{FORMAT_CACHE_VERSION}"
+    raw = f"{blob_sha}|{formatter}|{fingerprint}|{version}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def _format_cache_disk_path(key):
+    return os.path.join(FORMAT_CACHE_DIR, key[:2], key[2:] + '.txt')
+
+def _format_cache_remember(key, formatted):
+    global _format_cache_bytes
+    size = len(formatted)
+    if size > FORMAT_CACHE_MEMORY_MAX_BYTES:
+        return
+    with _format_cache_lock:
+        if key in _format_cache:
+            return
+        _format_cache[key] = formatted
+        _format_cache_bytes += size
+        while _format_cache_bytes > FORMAT_CACHE_MEMORY_MAX_BYTES:
+            _, evicted = _format_cache.popitem(last=False)
+            _format_cache_bytes -= len(evicted)
+
+def _format_cache_disk_usage():
+    total = 0
+    entries = []
+    for root, _, files in os.walk(FORMAT_CACHE_DIR):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            total += st.st_size
+            entries.append((st.st_mtime, st.st_size, os.path.join(root, name)))
+    return total, entries
+
+def _format_cache_disk_put(key, formatted):
+    global _format_cache_disk_bytes
+    path = _format_cache_disk_path(key)
+    data = formatted.encode('utf-8')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file first so concurrent readers never see partial output
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+    with _format_cache_lock:
+        if _format_cache_disk_bytes is None:
+            _format_cache_disk_bytes, _ = _format_cache_disk_usage()
+        else:
+            _format_cache_disk_bytes += len(data)
+        if _format_cache_disk_bytes <= FORMAT_CACHE_DISK_MAX_BYTES:
+            return
+        # Evict least recently used files (by mtime) down to 90% of the limit
+        total, entries = _format_cache_disk_usage()
+        entries.sort()
+        target = FORMAT_CACHE_DISK_MAX_BYTES * 0.9
+        for _, size, entry_path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(entry_path)
+                total -= size
+            except OSError:
+                pass
+        _format_cache_disk_bytes = total
+
+def format_cache_get(key):
+    with _format_cache_lock:
+        formatted = _format_cache.get(key)
+        if formatted is not None:
+            _format_cache.move_to_end(key)
+            cache_stats['format_cache_hits'] += 1
+            return formatted
+
+    if FORMAT_CACHE_DIR:
+        path = _format_cache_disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                formatted = f.read().decode('utf-8')
+            os.utime(path) # Refresh mtime for LRU eviction
+        except OSError:
+            formatted = None
+        if formatted is not None:
+            cache_stats['format_cache_disk_hits'] += 1
+            _format_cache_remember(key, formatted)
+            return formatted
+
+    cache_stats['format_cache_misses'] += 1
+    return None
+
+def format_cache_put(key, formatted):
+    _format_cache_remember(key, formatted)
+    if FORMAT_CACHE_DIR:
+        try:
+            _format_cache_disk_put(key, formatted)
+        except OSError as e:
+            print(f"Error writing format cache: {e}")
+
+def _autopep8_options(autopep8, ignore_newline):
+    options = autopep8.parse_args([''], apply_config=False)
+    options.max_line_length = 10000 if ignore_newline else 100
+    return options
+
+def _autopep8_run(autopep8, content, ext, options):
+    # fix_code normalizes its options in place, so each call gets a copy
+    return autopep8.fix_code(content, options=copy.copy(options))
+
+def _jsbeautifier_options(jsbeautifier, ignore_newline):
+    opts = jsbeautifier.default_options()
+    opts.indent_size = 4
+    opts.indent_char = ' '
+    opts.indent_with_tabs = False
+    opts.preserve_newlines = not ignore_newline
+    opts.max_preserve_newlines = 2
+    opts.space_in_paren = False
+    opts.space_in_empty_paren = False
+    opts.jslint_happy = True
+    opts.space_after_anon_function = True
+    opts.brace_style = "collapse"
+    opts.keep_array_indentation = False
+    opts.keep_function_indentation = False
+    opts.space_before_conditional = True
+    opts.unescape_strings = False
+    opts.e4x = True
+    opts.wrap_line_length = 0 if ignore_newline else 100 # 0 disables wrapping
+    return opts
+
+def _jsbeautifier_run(jsbeautifier, content, ext, opts):
+    # Pre-process JS files to normalize template literals
+    if ext in {'.js', '.ts', '.jsx', '.tsx'}:
+        content = normalize_template_literals(content)
+    return jsbeautifier.beautify(content, opts)
+
+def _template_literals_options(module, ignore_newline):
+    return None
+
+def _template_literals_run(module, content, ext, options):
+    return normalize_template_literals(content)
+
+def _xml_options(minidom, ignore_newline):
+    return {'indent': '    '}
+
+def _xml_run(minidom, content, ext, options):
+    # Re-indent from scratch: whitespace-only text nodes are dropped first so
+    # existing indentation doesn't double up
+    doc = minidom.parseString(content.encode('utf-8'))
+    stack = [doc]
+    while stack:
+        node = stack.pop()
+        for child in list(node.childNodes):
+            if child.nodeType == child.TEXT_NODE and not child.data.strip():
+                node.removeChild(child)
+            else:
+                stack.append(child)
+    formatted = doc.toprettyxml(indent=options['indent'])
+    if not content.lstrip().startswith('<?xml'):
+        formatted = formatted.split('\n', 1)[1] # toprettyxml always adds a declaration
+    return formatted
+
+class FormatterDaemon:
+    # Long-lived formatter processes speaking JSON lines on stdin/stdout. Each
+    # request {"id", "content", "ext", "ignore_newline"} is answered with
+    # {"id", "formatted"} or {"id", "error"}. A worker that times out or dies
+    # is killed and replaced on the next call.
+    def __init__(self, name, command, workers=1):
+        self.name = name
+        self.command = command
+        self.idle = queue.Queue()
+        self.ids = itertools.count(1)
+        for _ in range(workers):
+            self.idle.put(None) # Started on first use
+
+    def _start(self):
+        proc = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        lines = queue.Queue()
+
+        def read():
+            for line in proc.stdout:
+                lines.put(line)
+            lines.put(None)
+
+        threading.Thread(target=read, daemon=True, name=f'{self.name}-daemon').start()
+        return {'proc': proc, 'lines': lines}
+
+    def _kill(self, worker):
+        worker['proc'].kill()
+        worker['proc'].wait()
+        worker['proc'].stdin.close()
+
+    def format(self, content, ext, ignore_newline, timeout):
+        try:
+            worker = self.idle.get(timeout=timeout)
+        except queue.Empty:
+            raise FormatTimeoutError(f'no idle {self.name} worker')
+        # The time budget covers the request itself, not the wait for a worker
+        deadline = time.monotonic() + timeout
+        try:
+            if worker is None or worker['proc'].poll() is not None:
+                worker = self._start()
+            request_id = next(self.ids)
+            message = {'id': request_id, 'content': content, 'ext': ext, 'ignore_newline': bool(ignore_newline)}
+            worker['proc'].stdin.write(json.dumps(message).encode('utf-8') + b'\n')
+            worker['proc'].stdin.flush()
+            try:
+                line = worker['lines'].get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise FormatTimeoutError(f'{self.name} did not answer within {timeout}s')
+            if line is None:
+                raise RuntimeError(f'{self.name} daemon exited')
+            reply = json.loads(line)
+            if reply.get('id') != request_id:
+                raise RuntimeError(f'{self.name} daemon answered out of order')
+        except BaseException:
+            if worker is not None:
+                self._kill(worker)
+            worker = None
+            raise
+        finally:
+            self.idle.put(worker)
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply['formatted']
+
+    def close(self):
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            if worker is not None:
+                self._kill(worker)
+
+# Formatter registry: the module each formatter needs (imported on first use,
+# None for none), the extensions it handles, how to build its options (once
+# per ignore_newline value) and how to run it. 'sample' is used for warm-up.
+# 'max_size' (characters) and 'timeout' (seconds, default FORMAT_TIMEOUT)
+# bound each language; larger files are shown unformatted.
+FORMATTERS = {
+    'autopep8': {
+        'module': 'autopep8',
+        'extensions': {'.py'},
+        'options': _autopep8_options,
+        'run': _autopep8_run,
+        'sample': ('x=1\n', '.py'),
+        'max_size': 1024 * 1024,
+    },
+    'jsbeautifier': {
+        'module': 'jsbeautifier',
+        'extensions': JS_BEAUTIFY_EXTENSIONS,
+        'options': _jsbeautifier_options,
+        'run': _jsbeautifier_run,
+        'sample': ('var x=`${ 1 }`;', '.js'),
+        'max_size': 2 * 1024 * 1024,
+    },
+    'template_literals': {
+        'module': None,
+        'version': '1', # Bump when normalize_template_literals changes output
+        'extensions': {'.ts', '.tsx'},
+        'options': _template_literals_options,
+        'run': _template_literals_run,
+        'sample': ('var x=`${ 1 }`;', '.ts'),
+        'max_size': 2 * 1024 * 1024,
+    },
+    'xml': {
+        'module': 'xml.dom.minidom',
+        'extensions': {'.xml', '.xsd', '.xsl'},
+        'options': _xml_options,
+        'run': _xml_run,
+        'sample': ('<a><b/></a>', '.xml'),
+        'max_size': 4 * 1024 * 1024,
+        'timeout': 10,
+    },
+}
+
+# External formatters run as FormatterDaemon workers, e.g.
+# FORMAT_DAEMONS='{"prettier": {"command": ["node", "prettier_daemon.js"],
+#   "extensions": [".ts", ".tsx", ".jsx", ".scss"], "workers": 2, "timeout": 10}}'
+# A daemon takes over its extensions from the in-process formatters.
+for _name, _config in json.loads(os.environ.get('FORMAT_DAEMONS') or '{}').items():
+    FORMATTERS[_name] = {
+        'daemon': FormatterDaemon(_name, _config['command'], _config.get('workers', 1)),
+        'extensions': set(_config['extensions']),
+        'version': _config.get('version', ' '.join(_config['command'])),
+        'max_size': _config.get('max_size'),
+        'timeout': _config.get('timeout'),
+    }
+
+# Per-formatter overrides, e.g. FORMAT_LIMITS='{"autopep8": {"max_size": 200000, "timeout": 5}}'
+for _name, _limits in json.loads(os.environ.get('FORMAT_LIMITS') or '{}').items():
+    FORMATTERS[_name].update({k: v for k, v in _limits.items() if k in ('max_size', 'timeout')})
+
+_formatter_for_ext = {}
+for _name, _formatter in sorted(FORMATTERS.items(), key=lambda item: 'daemon' in item[1]):
+    _formatter_for_ext.update(dict.fromkeys(_formatter['extensions'], _name))
+_formatter_versions = {}
+_formatter_options = {}
+_formatter_options_lock = threading.Lock()
+
+def _formatter_module(name):
+    module_name = FORMATTERS[name]['module']
+    return importlib.import_module(module_name) if module_name else None
+
+def get_formatter_options(name, ignore_newline):
+    key = (name, bool(ignore_newline))
+    options = _formatter_options.get(key)
+    if options is None:
+        with _formatter_options_lock:
+            options = _formatter_options.get(key)
+            if options is None:
+                formatter = FORMATTERS[name]
+                options = _formatter_options[key] = formatter['options'](_formatter_module(name), ignore_newline)
+    return options
+
+def _format_code(content, ext, ignore_newline):
+    name = get_formatter_name(ext)
+    if name is None:
+        return content
+    formatter = FORMATTERS[name]
+    options = get_formatter_options(name, ignore_newline)
+    return formatter['run'](_formatter_module(name), content, ext, options)
+
+# Formatting runs in a pool of worker processes because autopep8 and
+# jsbeautifier are CPU-bound pure Python. FORMAT_WORKERS=0 formats inline on
+# the request thread instead.
+FORMAT_WORKERS = int(os.environ.get('FORMAT_WORKERS', min(4, os.cpu_count() or 1)))
+FORMAT_TIMEOUT = float(os.environ.get('FORMAT_TIMEOUT', 20))
+_daemon_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='format-daemon')
+
+def _inprocess_formatters():
+    return [name for name, formatter in FORMATTERS.items() if 'daemon' not in formatter]
+
+def _formatter_timeout(name):
+    return FORMATTERS[name].get('timeout') or FORMAT_TIMEOUT
+
+def _warm_formatter(name):
+    # Import the formatter, build both option sets and run it once
+    content, ext = FORMATTERS[name]['sample']
+    for ignore_newline in (False, True):
+        _format_code(content, ext, ignore_newline)
+
+def _format_worker_init():
+    # Pre-import and exercise the formatters so the first job is not slow
+    for name in _inprocess_formatters():
+        try:
+            _warm_formatter(name)
+        except Exception:
+            pass
+
+def _format_worker_main(conn):
+    # Format worker process: answers each (content, ext, ignore_newline) with
+    # ('ok', formatted) or ('error', message) until the pipe is closed
+    _format_worker_init()
+    conn.send(('ready', None))
+    while True:
+        try:
+            content, ext, ignore_newline = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send(('ok', _format_code(content, ext, ignore_newline)))
+        except Exception as e:
+            conn.send(('error', f'{type(e).__name__}: {e}'))
+
+class FormatPool:
+    # Worker processes for the in-process formatters, each driven by its own
+    # thread. Jobs wait in a shared queue, background jobs behind all others,
+    # and can be cancelled through their future until a worker picks them up. A job's timeout starts when its
+    # worker starts it; a job that times out kills only that worker, which is
+    # replaced before the next job.
+    def __init__(self, workers):
+        self.workers = workers
+        self.jobs = queue.PriorityQueue()
+        self.seq = itertools.count() # FIFO within a priority
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Spawns every worker; called on first submit or by the warm-up
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, daemon=True, name=f'format-worker-{len(self._threads)}')
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, content, ext, ignore_newline, timeout, background=False):
+        self.start()
+        future = Future()
+        self.jobs.put((int(background), next(self.seq), future, content, ext, ignore_newline, timeout))
+        return future
+
+    def _spawn(self):
+        conn, child_conn = multiprocessing.Pipe()
+        proc = multiprocessing.Process(target=_format_worker_main, args=(child_conn,), daemon=True)
+        proc.start()
+        child_conn.close()
+        conn.recv() # Warmed up and ready
+        return {'proc': proc, 'conn': conn}
+
+    def _kill(self, worker):
+        worker['proc'].kill()
+        worker['proc'].join()
+        worker['conn'].close()
+
+    def _run(self):
+        worker = None
+        while True:
+            if worker is None:
+                # Start (or replace) the worker before the next job arrives
+                try:
+                    worker = self._spawn()
+                except Exception as e:
+                    print(f"Format worker failed to start: {e}")
+            _, _, future, content, ext, ignore_newline, timeout = self.jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue # Cancelled while queued
+            try:
+                if worker is None:
+                    worker = self._spawn()
+                worker['conn'].send((content, ext, ignore_newline))
+                if not worker['conn'].poll(timeout):
+                    raise FormatTimeoutError(f'timed out after {timeout}s')
+                status, value = worker['conn'].recv()
+            except BaseException as e:
+                if worker is not None:
+                    self._kill(worker)
+                worker = None
+                if isinstance(e, (EOFError, OSError)) and not isinstance(e, FormatTimeoutError):
+                    e = RuntimeError('format worker exited')
+                future.set_exception(e)
+                continue
+            if status == 'ok':
+                future.set_result(value)
+            else:
+                future.set_exception(RuntimeError(value))
+
+_format_pool = FormatPool(FORMAT_WORKERS) if FORMAT_WORKERS > 0 else None
+
+def _cancel_format(job):
+    # Drops a job that hasn't started yet; a running job is left to finish
+    if job['future'] is not None:
+        job['future'].cancel()
+
+# Optional warm-up after startup: imports GitPython, and either spawns every
+# format pool worker (each runs _format_worker_init) or, with FORMAT_WORKERS=0,
+# warms the formatters in this process. Each step runs on its own thread.
+FORMAT_WARMUP = os.environ.get('FORMAT_WARMUP', '0') == '1'
+
+def _warm_format_pool():
+    if _format_pool is None:
+        for name in _inprocess_formatters():
+            _warm_formatter(name)
+        return
+    _format_pool.start()
+
+def start_warmup():
+    def run(step):
+        try:
+            step()
+        except Exception as e:
+            print(f"Warm-up step {step.__name__} failed: {e}")
+
+    threads = [threading.Thread(target=run, args=(step,), daemon=True, name='warmup')
+               for step in (_git, _warm_format_pool)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def _start_format(content, filename, ignore_newline=False, blob_sha=None, raw=False, background=False):
+    # Returns a job for _finish_format. 'value' is set when no formatting is
+    # needed; otherwise the job is run inline or is pending in the format pool.
+    # Background jobs (prefetch) only run when no interactive job is waiting.
+    job = {'value': None, 'future': None, 'content': content, 'filename': filename}
     if not content:
-        return ""
+        job['value'] = ""
+        return job
     
     ext = os.path.splitext(filename)[1].lower()
+    name = get_formatter_name(ext)
+    if raw or name is None:
+        job['value'] = content
+        return job
+    formatter = FORMATTERS[name]
+    if formatter.get('max_size') and len(content) > formatter['max_size']:
+        job['value'] = content # Too large to format within its time budget
+        return job
+
+    # Blobs are immutable, so a formatted blob can be reused across requests
+    cache_key = None
+    if blob_sha:
+        cache_key = format_cache_key(blob_sha, ext, ignore_newline)
+        cached = format_cache_get(cache_key)
+        if cached is not None:
+            job['value'] = cached
+            return job
+
+    # The timeout applies once a worker starts the job; time spent queued
+    # behind other jobs doesn't count against it
+    timeout = _formatter_timeout(name)
+    job.update({'cache_key': cache_key, 'ext': ext, 'ignore_newline': ignore_newline, 'formatter': name,
+                'timeout': timeout, 'start': time.perf_counter()})
+    if 'daemon' in formatter:
+        # Already out of process; a thread keeps both sides of a diff concurrent
+        job['future'] = _daemon_executor.submit(formatter['daemon'].format, content, ext, ignore_newline, timeout)
+    elif _format_pool is not None:
+        job['future'] = _format_pool.submit(content, ext, ignore_newline, timeout, background)
+    return job
+
+def _finish_format(job):
+    if job['value'] is not None:
+        return job['value']
     
+    future = job['future']
+    formatted = job['content'] # Fallback to original content
+    outcome = 'ok'
     try:
-        if ext == '.py':
-            options = {'max_line_length': 100}
-            if ignore_newline:
-                options['max_line_length'] = 10000
-            return autopep8.fix_code(content, options=options)
-        elif ext in {'.js', '.json', '.css', '.html'}:
-            # Pre-process JS files to normalize template literals
-            if ext in {'.js', '.ts', '.jsx', '.tsx'}:
-                 content = normalize_template_literals(content)
-
-            # jsbeautifier default options
-            opts = jsbeautifier.default_options()
-            opts.indent_size = 4
-            opts.indent_char = ' '
-            opts.indent_with_tabs = False
-            opts.preserve_newlines = not ignore_newline
-            opts.max_preserve_newlines = 2
-            opts.space_in_paren = False
-            opts.space_in_empty_paren = False
-            opts.jslint_happy = True
-            opts.space_after_anon_function = True
-            opts.brace_style = "collapse"
-            opts.keep_array_indentation = False
-            opts.keep_function_indentation = False
-            opts.space_before_conditional = True
-            opts.unescape_strings = False
-            opts.e4x = True
-            
-            if ignore_newline:
-                opts.wrap_line_length = 0 # Disable wrapping
-            else:
-                opts.wrap_line_length = 100
-                
-            return jsbeautifier.beautify(content, opts)
-        # Add more formatters here if needed
+        if future is None:
+            formatted = _format_code(job['content'], job['ext'], job['ignore_newline'])
+        else:
+            # The pool enforces the timeout and kills the worker on expiry
+            formatted = future.result()
+    except CancelledError:
+        outcome = 'cancelled'
+    except FormatTimeoutError as e:
+        outcome = 'timeout'
+        print(f"Error formatting {job['filename']}: {e}")
     except Exception as e:
-        print(f"Error formatting {filename}: {e}")
-        return content # Fallback to original content
-        
-    return content
+        outcome = 'error'
+        print(f"Error formatting {job['filename']}: {e}")
+
+    # Wall time from submit, so pool queueing shows up as formatter latency
+    record_span('format', time.perf_counter() - job['start'], len(job['content']), formatter=job['formatter'], outcome=outcome)
+    if outcome == 'ok' and job['cache_key']:
+        format_cache_put(job['cache_key'], formatted)
+    return formatted
+
+def format_code(content, filename, ignore_newline=False, blob_sha=None):
+    return _finish_format(_start_format(content, filename, ignore_newline, blob_sha))
+
+def _start_format_view(view, filename, ignore_newline=False, blob_sha=None, background=False):
+    # Binary placeholders and truncated pages are shown as-is: formatting a
+    # partial file is meaningless and must not land in the format cache
+    return _start_format(view['content'], filename, ignore_newline, blob_sha,
+                         raw=view['binary'] or view['truncated'], background=background)
+
+# Server-side line diff. Patience diff anchors on lines that are unique on
+# both sides; stretches with no unique lines fall back to Myers O(ND), capped at
+# DIFF_MYERS_MAX_EDITS edits. Past the cap the stretch is diffed in windows of
+# DIFF_MYERS_WINDOW lines, so each edit only costs its own window.
+DIFF_DEFAULT_CONTEXT = 3
+DIFF_MYERS_MAX_EDITS = 1000
+DIFF_MYERS_WINDOW = 1000
+# mode='auto' in get_file_content sends hunks once both sides together have
+# more lines than this; below it the full texts go to the browser diff editor
+DIFF_HUNKS_MIN_LINES = int(os.environ.get('DIFF_HUNKS_MIN_LINES', 5000))
+
+def _unique_anchors(a, alo, ahi, b, blo, bhi):
+    counts = {}
+    for i in range(alo, ahi):
+        entry = counts.get(a[i])
+        if entry is None:
+            counts[a[i]] = [1, 0, i, -1]
+        else:
+            entry[0] += 1
+    for j in range(blo, bhi):
+        entry = counts.get(b[j])
+        if entry is not None:
+            entry[1] += 1
+            entry[3] = j
+    pairs = sorted((e[2], e[3]) for e in counts.values() if e[0] == 1 and e[1] == 1)
+    if not pairs:
+        return []
+
+    # Longest increasing subsequence of the b positions (patience sorting)
+    tails = []
+    tail_idx = []
+    back = [-1] * len(pairs)
+    for idx, (_, j) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(idx)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = idx
+        back[idx] = tail_idx[pos - 1] if pos > 0 else -1
+    anchors = []
+    idx = tail_idx[-1]
+    while idx >= 0:
+        anchors.append(pairs[idx])
+        idx = back[idx]
+    anchors.reverse()
+    return anchors
+
+def _myers_matches(a, alo, ahi, b, blo, bhi, max_edits=DIFF_MYERS_MAX_EDITS):
+    # Matched (i, j) pairs, or None when the region needs more than max_edits
+    n = ahi - alo
+    m = bhi - blo
+    max_d = min(n + m, max_edits)
+    offset = max_d + 1
+    v = [0] * (2 * max_d + 3)
+    trace = []
+    for d in range(max_d + 1):
+        trace.append(v[:])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _myers_backtrack(trace, offset, n, m, alo, blo)
+    return None
+
+def _windowed_matches(a, alo, ahi, b, blo, bhi):
+    # Myers a window at a time. Only the matches in the first half of a window
+    # are kept, since its far end is an arbitrary cut, and the next window
+    # starts after the last kept match. Not minimal, but a window without
+    # matches (or past its own edit cap) just advances by half a window.
+    matches = []
+    half = DIFF_MYERS_WINDOW // 2
+    x, y = alo, blo
+    while x < ahi and y < bhi:
+        x_end, y_end = min(ahi, x + DIFF_MYERS_WINDOW), min(bhi, y + DIFF_MYERS_WINDOW)
+        window = sorted(_myers_matches(a, x, x_end, b, y, y_end, max_edits=half // 2) or [])
+        if x_end == ahi and y_end == bhi:
+            matches.extend(window)
+            break
+        kept = [(i, j) for i, j in window if i < x + half and j < y + half]
+        if kept:
+            matches.extend(kept)
+            x, y = kept[-1][0] + 1, kept[-1][1] + 1
+        else:
+            x, y = min(ahi, x + half), min(bhi, y + half)
+    return matches
+
+def _myers_backtrack(trace, offset, x, y, alo, blo):
+    matches = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[offset + prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            matches.append((alo + x, blo + y))
+        x, y = prev_x, prev_y
+    return matches
+
+def diff_line_opcodes(a, b):
+    # Returns difflib-style opcodes: (tag, i1, i2, j1, j2)
+    matches = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        # Common prefix and suffix
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            matches.append((ahi, bhi))
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = _unique_anchors(a, alo, ahi, b, blo, bhi)
+        if not anchors:
+            region = _myers_matches(a, alo, ahi, b, blo, bhi)
+            if region is None:
+                region = _windowed_matches(a, alo, ahi, b, blo, bhi)
+            matches.extend(region)
+            continue
+        prev_a, prev_b = alo, blo
+        for i, j in anchors:
+            matches.append((i, j))
+            stack.append((prev_a, i, prev_b, j))
+            prev_a, prev_b = i + 1, j + 1
+        stack.append((prev_a, ahi, prev_b, bhi))
+    matches.sort()
+
+    opcodes = []
+    i = j = 0
+    for mi, mj in matches + [(len(a), len(b))]:
+        if i < mi or j < mj:
+            tag = 'replace' if i < mi and j < mj else ('delete' if i < mi else 'insert')
+            opcodes.append((tag, i, mi, j, mj))
+        if mi < len(a):
+            if opcodes and opcodes[-1][0] == 'equal':
+                _, i1, _, j1, _ = opcodes[-1]
+                opcodes[-1] = ('equal', i1, mi + 1, j1, mj + 1)
+            else:
+                opcodes.append(('equal', mi, mi + 1, mj, mj + 1))
+        i, j = mi + 1, mj + 1
+    return opcodes
+
+def build_diff_hunks(old_lines, new_lines, context=DIFF_DEFAULT_CONTEXT):
+    # Group opcodes into unified-style hunks. Lines are prefixed with ' ', '-'
+    # or '+'. Unchanged stretches between hunks are listed in 'gaps' (0-based,
+    # end exclusive, new-side numbering) so clients can fetch them lazily.
+    opcodes = diff_line_opcodes(old_lines, new_lines)
+    hunks = []
+    current = None
+    for idx, (tag, i1, i2, j1, j2) in enumerate(opcodes):
+        if tag == 'equal':
+            if current is not None:
+                is_last = idx == len(opcodes) - 1
+                if i2 - i1 <= (context if is_last else 2 * context):
+                    # Short run: keep it inside the current hunk
+                    current['lines'].extend(' ' + line for line in old_lines[i1:i2])
+                    current['old_end'], current['new_end'] = i2, j2
+                    continue
+                current['lines'].extend(' ' + line for line in old_lines[i1:i1 + context])
+                current['old_end'], current['new_end'] = i1 + context, j1 + context
+                hunks.append(current)
+                current = None
+            continue
+
+        if current is None:
+            # Open a new hunk with leading context
+            _, e_i1, e_i2, e_j1, e_j2 = opcodes[idx - 1] if idx > 0 else ('equal', i1, i1, j1, j1)
+            lead = min(context, e_i2 - e_i1)
+            current = {
+                'old_start': i1 - lead,
+                'new_start': j1 - lead,
+                'lines': [' ' + line for line in old_lines[i1 - lead:i1]],
+            }
+        current['lines'].extend('-' + line for line in old_lines[i1:i2])
+        current['lines'].extend('+' + line for line in new_lines[j1:j2])
+        current['old_end'], current['new_end'] = i2, j2
+    if current is not None:
+        hunks.append(current)
+
+    gaps = []
+    prev_old = prev_new = 0
+    for hunk in hunks:
+        if hunk['new_start'] > prev_new:
+            gaps.append({'old_start': prev_old, 'new_start': prev_new, 'new_end': hunk['new_start']})
+        prev_old, prev_new = hunk['old_end'], hunk['new_end']
+    if prev_new < len(new_lines):
+        gaps.append({'old_start': prev_old, 'new_start': prev_new, 'new_end': len(new_lines)})
+
+    for hunk in hunks:
+        hunk['old_lines'] = hunk.pop('old_end') - hunk['old_start']
+        hunk['new_lines'] = hunk.pop('new_end') - hunk['new_start']
+    return {'hunks': hunks, 'gaps': gaps}
+
+def diff_content(old_formatted, new_formatted, mode='full', context=DIFF_DEFAULT_CONTEXT):
+    # Both texts for mode='full'. For 'hunks' only the changed regions cross
+    # the wire; unchanged gaps can be fetched on demand from
+    # /api/get_file_lines. 'auto' picks hunks above DIFF_HUNKS_MIN_LINES.
+    if mode not in ('auto', 'hunks'):
+        return {'old_content': old_formatted, 'new_content': new_formatted}
+    old_lines = old_formatted.splitlines()
+    new_lines = new_formatted.splitlines()
+    if mode == 'auto' and len(old_lines) + len(new_lines) <= DIFF_HUNKS_MIN_LINES:
+        return {'old_content': old_formatted, 'new_content': new_formatted}
+    result = build_diff_hunks(old_lines, new_lines, context=context)
+    result.update({
+        'mode': 'hunks',
+        'old_line_count': len(old_lines),
+        'new_line_count': len(new_lines),
+    })
+    return result
 
 @app.route('/')
 def index():
@@ -140,39 +1504,151 @@ def get_diff_files():
     if not repo_path or not commit_id:
         return jsonify({'error': 'Missing repo_path or commit_id'}), 400
 
+    # Optional listing filters (globs, extensions, change_types) are pushed
+    # into the tree diff; 'limit' pages the result from 'offset'
+    filtered = any(data.get(k) for k in ('globs', 'extensions', 'change_types'))
+    offset = int(data.get('offset', 0))
+    limit = data.get('limit')
+
     try:
-        repo = git.Repo(repo_path)
-        commit = repo.commit(commit_id)
-        
-        # Determine parent commit to compare with
-        if commit.parents:
-            parent = commit.parents[0]
-            diffs = parent.diff(commit)
-        else:
-            # Initial commit: compare with empty tree
-            diffs = commit.diff(git.NULL_TREE)
+        with repo_handle(repo_path) as repo:
+            index, base, head, _ = get_request_diff_index(repo, data, filtered=filtered)
 
         file_list = []
-        for diff in diffs:
-            # a_path is old, b_path is new
-            path = diff.b_path if diff.b_path else diff.a_path
-            path = path.replace('\\', '/')
-            
+        for path, entry in index.items():
             if is_static_file(path):
                 continue
                 
-            change_type = diff.change_type # 'A', 'D', 'M', 'R'
-            
             file_list.append({
                 'path': path,
-                'change_type': change_type
+                'change_type': entry['change_type']
             })
-            
-        return jsonify({'files': file_list})
+
+        result = {
+            'base': base.hexsha if base is not None else None,
+            'head': head.hexsha,
+            # Merge commits can be reviewed against each parent via 'parent'
+            'parents': [p.hexsha for p in head.parents]
+        }
+        if limit is not None:
+            end = offset + int(limit)
+            result['total'] = len(file_list)
+            result['next_offset'] = end if end < len(file_list) else None
+            file_list = file_list[offset:end]
+        result['files'] = file_list
+        return jsonify(result)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Directory-at-a-time listing for large commits. The filtered diff index is
+# folded into a trie once (cached alongside the index); each request returns
+# one page of one directory's children, with per-directory file counts.
+# Chains of directories that only contain a single subdirectory are
+# compressed into one entry ('a/b/c').
+DIFF_TREE_PAGE_SIZE = 500
+DIFF_TREE_CACHE_MAX = 16
+_diff_trees = OrderedDict()
+_diff_trees_lock = threading.Lock()
+
+def _new_tree_node():
+    return {'dirs': {}, 'files': {}, 'count': 0, 'changes': {}, 'entries': None}
+
+def build_diff_tree(index):
+    root = _new_tree_node()
+    for path, entry in index.items():
+        change_type = entry['change_type']
+        node = root
+        parts = path.split('/')
+        for part in parts[:-1]:
+            node['count'] += 1
+            node['changes'][change_type] = node['changes'].get(change_type, 0) + 1
+            child = node['dirs'].get(part)
+            if child is None:
+                child = node['dirs'][part] = _new_tree_node()
+            node = child
+        node['count'] += 1
+        node['changes'][change_type] = node['changes'].get(change_type, 0) + 1
+        node['files'][parts[-1]] = entry
+    return root
+
+def get_diff_tree(key, index):
+    with _diff_trees_lock:
+        cached = _diff_trees.get(key)
+        if cached is not None and cached[0] is index:
+            _diff_trees.move_to_end(key)
+            return cached[1]
+    with span('diff_tree_build') as info:
+        tree = build_diff_tree(index)
+        info['bytes'] = len(index)
+    with _diff_trees_lock:
+        _diff_trees[key] = (index, tree)
+        while len(_diff_trees) > DIFF_TREE_CACHE_MAX:
+            _diff_trees.popitem(last=False)
+    return tree
+
+def diff_tree_entries(node, dir_path):
+    # Sorted children of a trie node (directories first), built once per node
+    if node['entries'] is not None:
+        return node['entries']
+    prefix = dir_path + '/' if dir_path else ''
+    entries = []
+    for name in sorted(node['dirs'], key=str.lower):
+        child = node['dirs'][name]
+        while not child['files'] and len(child['dirs']) == 1:
+            (sub, child), = child['dirs'].items()
+            name = f'{name}/{sub}'
+        entries.append({'type': 'dir', 'name': name, 'path': prefix + name,
+                        'count': child['count'], 'change_counts': child['changes']})
+    for name in sorted(node['files'], key=str.lower):
+        entries.append({'type': 'file', 'name': name, 'path': prefix + name,
+                        'change_type': node['files'][name]['change_type']})
+    node['entries'] = entries
+    return entries
+
+@app.route('/api/get_diff_tree', methods=['POST'])
+def get_diff_tree_route():
+    data = request.json
+    repo_path = data.get('repo_path')
+    commit_id = data.get('commit_id')
+    dir_path = (data.get('dir') or '').replace('\\', '/').strip('/')
+    offset = int(data.get('offset', 0))
+    limit = int(data.get('limit', DIFF_TREE_PAGE_SIZE))
+    
+    if not repo_path or not commit_id:
+        return jsonify({'error': 'Missing repo_path or commit_id'}), 400
+
+    try:
+        with repo_handle(repo_path) as repo:
+            index, base, head, key = get_request_diff_index(repo, data, filtered=True)
+        tree = get_diff_tree(key, index)
+
+        node = tree
+        for part in dir_path.split('/') if dir_path else []:
+            node = node['dirs'].get(part)
+            if node is None:
+                return jsonify({'error': 'Directory not found in diff'}), 404
+
+        entries = diff_tree_entries(node, dir_path)
+        end = offset + limit
+        return jsonify({
+            'dir': dir_path,
+            'entries': entries[offset:end],
+            'offset': offset,
+            'total': len(entries),
+            'next_offset': end if end < len(entries) else None,
+            'file_count': node['count'],
+            'change_counts': node['changes'],
+            # How many of the client's read marks fall inside this listing
+            'read_count': sum(1 for path in set(data.get('read_paths') or ()) if path in index),
+            'base': base.hexsha if base is not None else None,
+            'head': head.hexsha,
+            'parents': [p.hexsha for p in head.parents]
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/get_file_content', methods=['POST'])
 def get_file_content():
     data = request.json
@@ -180,61 +1656,195 @@ def get_file_content():
     commit_id = data.get('commit_id')
     file_path = data.get('file_path')
     ignore_whitespace = data.get('ignore_whitespace', False)
+    mode = data.get('mode', 'full') # 'full', 'hunks' or 'auto'
+    context = int(data.get('context', DIFF_DEFAULT_CONTEXT))
+    # Byte offsets of the page to show for blobs over BLOB_MAX_BYTES
+    old_offset = int(data.get('old_offset', 0))
+    new_offset = int(data.get('new_offset', 0))
     
     if not repo_path or not commit_id or not file_path:
         return jsonify({'error': 'Missing parameters'}), 400
     
     try:
-        repo = git.Repo(repo_path)
-        commit = repo.commit(commit_id)
-        
-        if commit.parents:
-            parent = commit.parents[0]
-            diffs = parent.diff(commit)
-        else:
-            diffs = commit.diff(git.NULL_TREE)
+        with repo_handle(repo_path) as repo:
+            index, _, _, _ = get_request_diff_index(repo, data)
+            target_diff = index.get(file_path.replace('\\', '/'))
             
-        target_diff = None
-        for diff in diffs:
-            path = diff.b_path if diff.b_path else diff.a_path
-            if path == file_path:
-                target_diff = diff
-                break
-        
-        if not target_diff:
-            return jsonify({'error': 'File not found in diff'}), 404
+            if not target_diff:
+                return jsonify({'error': 'File not found in diff'}), 404
+                
+            empty = make_blob_view(b'', 0)
             
-        old_content = ""
-        new_content = ""
-        
-        # Get old content
-        if target_diff.a_blob:
-            try:
-                old_content = target_diff.a_blob.data_stream.read().decode('utf-8')
-            except UnicodeDecodeError:
-                old_content = "<Binary or Non-UTF8 Content>"
-        
-        # Get new content
-        if target_diff.b_blob:
-            try:
-                new_content = target_diff.b_blob.data_stream.read().decode('utf-8')
-            except UnicodeDecodeError:
-                new_content = "<Binary or Non-UTF8 Content>"
+            # Get old content
+            old_view = empty
+            if target_diff['a_sha']:
+                old_view = read_blob_view(repo, target_diff['a_sha'], offset=old_offset)
+            
+            # Get new content
+            new_view = empty
+            if target_diff['b_sha']:
+                new_view = read_blob_view(repo, target_diff['b_sha'], offset=new_offset)
                 
-        # Format content
-        old_formatted = format_code(old_content, file_path, ignore_newline=ignore_whitespace)
-        new_formatted = format_code(new_content, file_path, ignore_newline=ignore_whitespace)
-        
-        return jsonify({
-            'old_content': old_formatted,
-            'new_content': new_formatted,
+        # Format both sides concurrently
+        old_job = _start_format_view(old_view, file_path, ignore_whitespace, target_diff['a_sha'])
+        new_job = _start_format_view(new_view, file_path, ignore_whitespace, target_diff['b_sha'])
+        old_formatted = _finish_format(old_job)
+        new_formatted = _finish_format(new_job)
+        blob_info = {
+            'old_size': old_view['size'],
+            'new_size': new_view['size'],
+            'old_truncated': old_view['truncated'],
+            'new_truncated': new_view['truncated'],
+            'old_offset': old_view['offset'],
+            'new_offset': new_view['offset'],
+            'old_next_offset': old_view['next_offset'],
+            'new_next_offset': new_view['next_offset'],
+        }
+
+        result = diff_content(old_formatted, new_formatted, mode, context)
+        result.update({
             'file_path': file_path,
             'language': get_language_from_ext(file_path)
         })
+        result.update(blob_info)
+        return jsonify(result)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/get_file_lines', methods=['POST'])
+def get_file_lines():
+    data = request.json
+    repo_path = data.get('repo_path')
+    commit_id = data.get('commit_id')
+    file_path = data.get('file_path')
+    ignore_whitespace = data.get('ignore_whitespace', False)
+    side = data.get('side', 'new') # 'old' or 'new'
+    start = int(data.get('start', 0))
+    end = data.get('end')
+    # Byte offset of the blob page the line numbers refer to, as passed to
+    # get_file_content for blobs over BLOB_MAX_BYTES
+    offset = int(data.get('offset', 0))
+    
+    if not repo_path or not commit_id or not file_path:
+        return jsonify({'error': 'Missing parameters'}), 400
+    
+    try:
+        with repo_handle(repo_path) as repo:
+            index, _, _, _ = get_request_diff_index(repo, data)
+            target_diff = index.get(file_path.replace('\\', '/'))
+            
+            if not target_diff:
+                return jsonify({'error': 'File not found in diff'}), 404
+
+            blob_sha = target_diff['a_sha'] if side == 'old' else target_diff['b_sha']
+            view = read_blob_view(repo, blob_sha, offset=offset) if blob_sha else make_blob_view(b'', 0)
+
+        # Same formatting (and format cache entry) as get_file_content
+        lines = _finish_format(_start_format_view(view, file_path, ignore_whitespace, blob_sha)).splitlines()
+        end = len(lines) if end is None else min(int(end), len(lines))
+        return jsonify({'start': start, 'end': end, 'lines': lines[start:end]})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Files per cat-file/format round in get_commit_contents. Bounds the number of
+# blobs held in memory while a large commit is streamed.
+COMMIT_CONTENTS_CHUNK_SIZE = 32
+
+def _job_ready(job):
+    return job['future'] is None or job['future'].done()
+
+def _stream_commit_contents(repo_path, data, file_paths, ignore_whitespace):
+    mode = data.get('mode', 'full') # As in get_file_content
+    with repo_handle(repo_path) as repo:
+        index, _, _, _ = get_request_diff_index(repo, data)
+        if file_paths is None:
+            entries = [e for path, e in index.items() if not is_static_file(path)]
+        else:
+            entries = []
+            for path in file_paths:
+                entry = index.get(path.replace('\\', '/'))
+                if entry is None:
+                    yield {'file_path': path, 'error': 'File not found in diff'}
+                else:
+                    entries.append(entry)
+
+        # At most one job per format worker is in flight, so a prefetch never
+        # floods the pool; its jobs also queue behind interactive ones
+        max_in_flight = max(1, FORMAT_WORKERS)
+        pending = []
+
+        def emit_ready(block):
+            # Files whose sides are both formatted, in completion order. With
+            # block=True first waits for at least one job to finish.
+            if block:
+                futures = [job['future'] for _, sides in pending for job in sides if not _job_ready(job)]
+                if futures:
+                    wait_futures(futures, return_when=FIRST_COMPLETED)
+            for item in [p for p in pending if all(_job_ready(job) for job in p[1])]:
+                pending.remove(item)
+                entry, (old_job, new_job) = item
+                result = diff_content(_finish_format(old_job), _finish_format(new_job), mode)
+                result.update({
+                    'file_path': entry['path'],
+                    'change_type': entry['change_type'],
+                    'old_truncated': old_job['truncated'],
+                    'new_truncated': new_job['truncated'],
+                    'language': get_language_from_ext(entry['path'])
+                })
+                yield result
+
+        try:
+            for start in range(0, len(entries), COMMIT_CONTENTS_CHUNK_SIZE):
+                chunk = entries[start:start + COMMIT_CONTENTS_CHUNK_SIZE]
+                shas = {sha for e in chunk for sha in (e['a_sha'], e['b_sha']) if sha}
+                blobs = dict(iter_blobs_batch(repo, sorted(shas)))
+
+                for entry in chunk:
+                    while sum(not _job_ready(job) for _, sides in pending for job in sides) >= max_in_flight:
+                        yield from emit_ready(block=True)
+                    sides = []
+                    for sha in (entry['a_sha'], entry['b_sha']):
+                        view = blobs.get(sha) if sha else None
+                        if view is None:
+                            view = make_blob_view(b'', 0)
+                        job = _start_format_view(view, entry['path'], ignore_whitespace, sha, background=True)
+                        job['truncated'] = view['truncated']
+                        sides.append(job)
+                    pending.append((entry, sides))
+                    yield from emit_ready(block=False)
+                blobs = None
+
+            while pending:
+                yield from emit_ready(block=True)
+        finally:
+            # Jobs still queued when the client goes away are dropped
+            for _, sides in pending:
+                for job in sides:
+                    _cancel_format(job)
+
+@app.route('/api/get_commit_contents', methods=['POST'])
+def get_commit_contents():
+    data = request.json
+    repo_path = data.get('repo_path')
+    commit_id = data.get('commit_id')
+    file_paths = data.get('file_paths') # None means every non-static file
+    ignore_whitespace = data.get('ignore_whitespace', False)
+    
+    if not repo_path or not commit_id:
+        return jsonify({'error': 'Missing repo_path or commit_id'}), 400
+
+    def generate():
+        # One JSON object per line, written as soon as each file is formatted
+        try:
+            for item in _stream_commit_contents(repo_path, data, file_paths, ignore_whitespace):
+                yield json.dumps(item) + '\n'
+        except Exception as e:
+            yield json.dumps({'error': str(e)}) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
 def get_language_from_ext(filename):
     ext = os.path.splitext(filename)[1].lower()
     map = {
@@ -244,6 +1854,9 @@ def get_language_from_ext(filename):
         '.html': 'html',
         '.css': 'css',
         '.ts': 'typescript',
+        '.tsx': 'typescript',
+        '.jsx': 'javascript',
+        '.scss': 'scss',
         '.java': 'java',
         '.c': 'c',
         '.cpp': 'cpp',
@@ -253,6 +1866,394 @@ def get_language_from_ext(filename):
     }
     return map.get(ext, 'plaintext')
 
+# Sync applies one patch to many target checkouts. Each target escalates on
+# its own (full context -> -U0 -> -U0 --reject -> optional overwrite) in a
+# bounded thread pool, while every patch variant is generated only once.
+SYNC_MAX_WORKERS = int(os.environ.get('SYNC_MAX_WORKERS', 8))
+SYNC_APPLY_TIMEOUT = float(os.environ.get('SYNC_APPLY_TIMEOUT', 60))
+
+class SyncError(Exception):
+    pass
+
+# Paths per `git diff` call. Long path lists are split so the command line
+# stays well under the Windows limit (32K characters).
+SYNC_PATHSPEC_CHUNK = 200
+
+class CommitPatchSet:
+    # Lazily generated patch files for base..head (base None for a root
+    # commit), one per context level. Safe to share between the target
+    # worker threads. file_paths=None patches
+    # every non-static file without listing paths; otherwise renamed files
+    # (looked up in the diff index) bring their old path along so the patch
+    # also removes it.
+    def __init__(self, repo, base, head, file_paths, index=None):
+        self.repo = repo
+        self.base = base
+        self.head = head
+        self.path_groups = None
+        if file_paths is not None:
+            self.path_groups = []
+            for path in file_paths:
+                entry = (index or {}).get(path)
+                group = [path]
+                if entry and entry['change_type'] == 'R' and entry['a_path'] != path:
+                    group.append(entry['a_path'])
+                self.path_groups.append(group)
+        self._patches = {}
+        self._lock = threading.Lock()
+
+    def get(self, context_lines=None):
+        # Returns the patch file path, or None when the diff is empty
+        with self._lock:
+            if context_lines not in self._patches:
+                self._patches[context_lines] = self._write(context_lines)
+            return self._patches[context_lines]
+
+    def _pathspec_chunks(self):
+        if self.path_groups is None:
+            return [[f':(exclude,glob,icase)**/*{ext}' for ext in sorted(STATIC_EXTENSIONS)]]
+        # A rename's old and new path always land in the same chunk
+        chunks = []
+        for i in range(0, len(self.path_groups), SYNC_PATHSPEC_CHUNK):
+            chunks.append([path for group in self.path_groups[i:i + SYNC_PATHSPEC_CHUNK] for path in group])
+        return chunks
+
+    def _write(self, context_lines):
+        fd, patch_file = tempfile.mkstemp(suffix='.patch')
+        with os.fdopen(fd, 'wb') as f:
+            cmd_diff = ['git', 'diff', '--binary', f'-M{DIFF_RENAME_THRESHOLD}%']
+            if context_lines is not None:
+                cmd_diff.append(f'-U{context_lines}')
+                
+            cmd_diff.extend([self.base.hexsha if self.base is not None else _git().NULL_TREE, self.head.hexsha])
+            
+            cmd_diff.append('--')
+            # Patches of disjoint path sets concatenate into one valid patch
+            for chunk in self._pathspec_chunks():
+                subprocess.run(cmd_diff + chunk, cwd=self.repo.working_dir, stdout=f, check=True)
+
+        if os.path.getsize(patch_file) == 0:
+            os.unlink(patch_file)
+            return None
+        return patch_file
+
+    def cleanup(self):
+        with self._lock:
+            for patch_file in self._patches.values():
+                if patch_file and os.path.exists(patch_file):
+                    os.unlink(patch_file)
+            self._patches.clear()
+
+def git_apply(patch_file, target_root, context_lines=None, allow_reject=False, check=False):
+    if not os.path.exists(target_root):
+        return {'target': target_root, 'status': 'error', 'message': 'Directory not found'}
+
+    cmd_apply = [
+        'git', 'apply',
+        '-p1',
+        '--whitespace=nowarn',
+        '--ignore-space-change',
+        '--ignore-whitespace',
+        '--verbose',
+        patch_file
+    ]
+    
+    if context_lines == 0:
+        cmd_apply.insert(2, '--unidiff-zero')
+        
+    if allow_reject:
+        cmd_apply.append('--reject')
+
+    if check:
+        # Dry run: report applicability without touching the target
+        cmd_apply.insert(2, '--check')
+
+    if check:
+        stage = 'check'
+    elif allow_reject:
+        stage = 'reject'
+    else:
+        stage = 'default' if context_lines is None else f'U{context_lines}'
+    try:
+        with span('git_apply', stage=stage) as info:
+            info['bytes'] = os.path.getsize(patch_file)
+            proc = subprocess.run(cmd_apply, capture_output=True, text=True, cwd=target_root, timeout=SYNC_APPLY_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return {'target': target_root, 'status': 'failed', 'message': f'git apply timed out after {SYNC_APPLY_TIMEOUT}s'}
+    
+    if proc.returncode == 0:
+        return {'target': target_root, 'status': 'success'}
+
+    msg = proc.stderr if proc.stderr else proc.stdout
+    
+    # If --reject was used, and we have failure, it means some hunks failed.
+    # We can check if .rej files were created, but git apply usually tells us.
+    if allow_reject and 'Rejected' in msg:
+         return {'target': target_root, 'status': 'partial', 'message': 'Partial apply. Check .rej files.'}
+    return {'target': target_root, 'status': 'failed', 'message': msg}
+
+def force_overwrite_file(target_root, file_path, new_content):
+    # Construct full path
+    # target is the root. file_path is relative.
+    # file_path might contain forward slashes. os.path.join handles it on Windows if properly split
+    # but file_path is from git, so forward slashes.
+    full_dest_path = os.path.join(target_root, *file_path.split('/'))
+    
+    try:
+        # Ensure dir exists
+        os.makedirs(os.path.dirname(full_dest_path), exist_ok=True)
+        with open(full_dest_path, 'wb') as f:
+            f.write(new_content)
+        return {'target': target_root, 'status': 'success', 'message': 'Forced overwrite'}
+    except Exception as e:
+        return {'target': target_root, 'status': 'failed', 'message': f'Overwrite failed: {e}'}
+
+def sync_target(target_root, patches, file_path, force_overwrite=False, get_new_content=None):
+    # First attempt: Standard context
+    result = git_apply(patches.get(), target_root)
+    if result['status'] == 'success':
+        return result
+
+    # Retry with -U0
+    result = git_apply(patches.get(0), target_root, context_lines=0)
+    if result['status'] == 'success':
+        return result
+
+    # If still failed, try --reject (Partial Apply)
+    result = git_apply(patches.get(0), target_root, context_lines=0, allow_reject=True)
+    if result['status'] in ['success', 'partial'] or not force_overwrite:
+        return result
+
+    # Force Overwrite Option
+    try:
+        new_content = get_new_content()
+    except Exception as e:
+        return {'target': target_root, 'status': 'failed', 'message': f'Force overwrite error: {e}'}
+    if new_content is None:
+        return {'target': target_root, 'status': 'failed', 'message': 'Could not get new content for overwrite'}
+    return force_overwrite_file(target_root, file_path, new_content)
+
+def _timed_sync(target, fn, *args):
+    with span('sync_target', target=target):
+        return fn(*args)
+
+def _new_content_reader(repo, index):
+    # Full new blob of a file for force overwrite, read once for all targets
+    contents = {}
+    lock = threading.Lock()
+
+    def get_new_content(file_path):
+        with lock:
+            if file_path not in contents:
+                target_diff = index.get(file_path)
+                contents[file_path] = None
+                if target_diff and target_diff['b_sha']:
+                    contents[file_path] = read_blob(repo, target_diff['b_sha']) # Binary read
+            return contents[file_path]
+    return get_new_content
+
+def _iter_target_results(targets, patch_sets, fn, *args):
+    # Runs fn(target, *args) for every target on the sync workers and yields
+    # the results in completion order. The first patch set must not be empty;
+    # all of them are cleaned up once the caller is done.
+    try:
+        if patch_sets[0].get() is None:
+            raise SyncError('No changes found')
+        executor = ThreadPoolExecutor(max_workers=max(1, min(SYNC_MAX_WORKERS, len(targets))))
+        try:
+            futures = [executor.submit(_timed_sync, target, fn, target, *args) for target in targets]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # Targets not started yet are dropped when the caller stops early
+            executor.shutdown(wait=True, cancel_futures=True)
+    finally:
+        for patches in patch_sets:
+            patches.cleanup()
+
+def iter_sync_results(repo_path, data, file_path, target_roots, force_overwrite=False):
+    # Yields one result per target in completion order. data describes the
+    # range as in get_request_diff_index.
+    targets = [t.strip() for t in target_roots if t.strip()]
+    with repo_handle(repo_path) as repo:
+        index, base, head, _ = get_request_diff_index(repo, data)
+        patches = CommitPatchSet(repo, base, head, [file_path], index)
+        get_new_content = _new_content_reader(repo, index)
+        yield from _iter_target_results(targets, [patches], sync_target, patches, file_path, force_overwrite,
+                                        lambda: get_new_content(file_path))
+
+def sync_target_files(target_root, combined, file_patches, file_paths, force_overwrite=False, get_new_content=None):
+    # Apply the combined patch in a single git apply; if that fails at every
+    # context level, fall back to the per-file escalation and report per file
+    result = git_apply(combined.get(), target_root)
+    if result['status'] != 'success':
+        result = git_apply(combined.get(0), target_root, context_lines=0)
+    if result['status'] == 'success':
+        result['files'] = [{'file_path': p, 'status': 'success'} for p in file_paths]
+        return result
+    if result['status'] == 'error':
+        return result
+
+    files = []
+    for file_path in file_paths:
+        patches = file_patches[file_path]
+        if patches.get() is None:
+            files.append({'file_path': file_path, 'status': 'success', 'message': 'No changes found'})
+            continue
+        r = sync_target(target_root, patches, file_path, force_overwrite, lambda: get_new_content(file_path))
+        r.pop('target')
+        r['file_path'] = file_path
+        files.append(r)
+
+    ok = sum(1 for f in files if f['status'] == 'success')
+    if ok == len(files):
+        status = 'success'
+    elif ok or any(f['status'] == 'partial' for f in files):
+        status = 'partial'
+    else:
+        status = 'failed'
+    return {'target': target_root, 'status': status, 'message': f'Applied per file: {ok} / {len(files)} succeeded', 'files': files}
+
+def iter_commit_sync_results(repo_path, data, file_paths, target_roots, force_overwrite=False):
+    # Yields one result per target in completion order. file_paths=None
+    # syncs every non-static file in the range.
+    targets = [t.strip() for t in target_roots if t.strip()]
+    with repo_handle(repo_path) as repo:
+        index, base, head, _ = get_request_diff_index(repo, data)
+        # The whole commit is patched without a path list
+        combined_paths = file_paths
+        if file_paths is None:
+            file_paths = [path for path in index if not is_static_file(path)]
+        if not file_paths:
+            raise SyncError('No changes found')
+
+        combined = CommitPatchSet(repo, base, head, combined_paths, index)
+        file_patches = {path: CommitPatchSet(repo, base, head, [path], index) for path in file_paths}
+        yield from _iter_target_results(targets, [combined, *file_patches.values()], sync_target_files, combined,
+                                        file_patches, file_paths, force_overwrite, _new_content_reader(repo, index))
+
+def _sync_response(results, target_roots, stream):
+    if stream:
+        def generate():
+            try:
+                for result in results:
+                    yield json.dumps(result) + '\n'
+            except Exception as e:
+                yield json.dumps({'error': str(e)}) + '\n'
+        return Response(generate(), mimetype='application/x-ndjson')
+        
+    try:
+        final_results = list(results)
+        # Keep the targets in the order they were given
+        order = {t.strip(): i for i, t in enumerate(target_roots)}
+        final_results.sort(key=lambda r: order.get(r['target'], 0))
+        return jsonify({'results': final_results})
+    except SyncError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Precheck results keyed by (repo, base sha, head sha, file, target, target
+# file state). A cell is re-checked only when the target file itself changed.
+PRECHECK_CACHE_MAX = 20000
+_precheck_cache = OrderedDict()
+_precheck_cache_lock = threading.Lock()
+
+cache_stats.update({
+    'precheck_cache_hits': 0,
+    'precheck_cache_misses': 0,
+})
+
+def _target_file_state(target_root, entry):
+    # Size and mtime of every path the patch touches in the target
+    state = []
+    for path in {entry['a_path'], entry['b_path']} - {None}:
+        try:
+            st = os.stat(os.path.join(target_root, *path.split('/')))
+            state.append((path, st.st_size, st.st_mtime_ns))
+        except OSError:
+            state.append((path, None, None))
+    return tuple(sorted(state))
+
+def precheck_cell(target_root, patches):
+    # 'clean': applies with full context; 'fuzzy': only with -U0;
+    # 'conflict': neither; 'error': target directory missing
+    if patches.get() is None:
+        return 'clean'
+    result = git_apply(patches.get(), target_root, check=True)
+    if result['status'] == 'success':
+        return 'clean'
+    if result['status'] == 'error':
+        return 'error'
+    result = git_apply(patches.get(0), target_root, context_lines=0, check=True)
+    return 'fuzzy' if result['status'] == 'success' else 'conflict'
+
+def precheck_sync(repo_path, data, file_paths, target_roots):
+    targets = [t.strip() for t in target_roots if t.strip()]
+    with repo_handle(repo_path) as repo:
+        index, base, head, _ = get_request_diff_index(repo, data)
+        base_sha = base.hexsha if base is not None else None
+        if file_paths is None:
+            file_paths = [path for path in index if not is_static_file(path)]
+        file_paths = [p for p in file_paths if p in index]
+
+        repo_key = _repo_key(repo.working_dir)
+        matrix = [[None] * len(targets) for _ in file_paths]
+        todo = []
+        for i, file_path in enumerate(file_paths):
+            for j, target in enumerate(targets):
+                if not os.path.isdir(target):
+                    matrix[i][j] = 'error'
+                    continue
+                key = (repo_key, base_sha, head.hexsha, file_path, target, _target_file_state(target, index[file_path]))
+                with _precheck_cache_lock:
+                    status = _precheck_cache.get(key)
+                    if status is not None:
+                        _precheck_cache.move_to_end(key)
+                        cache_stats['precheck_cache_hits'] += 1
+                        matrix[i][j] = status
+                        continue
+                    cache_stats['precheck_cache_misses'] += 1
+                todo.append((i, j, key))
+
+        file_patches = {}
+        try:
+            for i, _, _ in todo:
+                if file_paths[i] not in file_patches:
+                    file_patches[file_paths[i]] = CommitPatchSet(repo, base, head, [file_paths[i]], index)
+            if todo:
+                with ThreadPoolExecutor(max_workers=SYNC_MAX_WORKERS) as executor:
+                    futures = {executor.submit(precheck_cell, targets[j], file_patches[file_paths[i]]): (i, j, key)
+                               for i, j, key in todo}
+                    for future in as_completed(futures):
+                        i, j, key = futures[future]
+                        matrix[i][j] = future.result()
+                        with _precheck_cache_lock:
+                            _precheck_cache[key] = matrix[i][j]
+                            while len(_precheck_cache) > PRECHECK_CACHE_MAX:
+                                _precheck_cache.popitem(last=False)
+        finally:
+            for patches in file_patches.values():
+                patches.cleanup()
+
+    return {'files': file_paths, 'targets': targets, 'matrix': matrix, 'checked': len(todo)}
+
+@app.route('/api/precheck_sync', methods=['POST'])
+def precheck_sync_route():
+    data = request.json
+    repo_path = data.get('repo_path')
+    commit_id = data.get('commit_id')
+    file_paths = data.get('file_paths') # List of paths; omit for every non-static file
+    target_roots = data.get('target_roots') # List of strings
+    
+    if not repo_path or not commit_id or not target_roots:
+        return jsonify({'error': 'Missing parameters'}), 400
+
+    try:
+        return jsonify(precheck_sync(repo_path, data, file_paths, target_roots))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/sync_file_diff', methods=['POST'])
 def sync_file_diff():
     data = request.json
@@ -261,190 +2262,298 @@ def sync_file_diff():
     file_path = data.get('file_path')
     target_roots = data.get('target_roots') # List of strings
     force_overwrite = data.get('force_overwrite', False) # New parameter
+    stream = data.get('stream', False) # NDJSON, one line per target as it completes
     
     if not repo_path or not commit_id or not file_path or not target_roots:
         return jsonify({'error': 'Missing parameters'}), 400
-        
-    try:
-        repo = git.Repo(repo_path)
-        commit = repo.commit(commit_id)
-        
-        # Helper function to try applying patch with different context levels
-        def try_patch_and_apply(context_lines=None, allow_reject=False):
-            # 1. Generate Diff Patch
-            fd, patch_file = tempfile.mkstemp(suffix='.patch')
-            os.close(fd)
-            
-            try:
-                with open(patch_file, 'wb') as f:
-                    cmd_diff = ['git', 'diff', '--binary']
-                    if context_lines is not None:
-                        cmd_diff.append(f'-U{context_lines}')
-                        
-                    if commit.parents:
-                        cmd_diff.extend([commit.parents[0].hexsha, commit.hexsha])
-                    else:
-                        cmd_diff.extend([git.NULL_TREE, commit.hexsha])
-                    
-                    cmd_diff.append('--')
-                    cmd_diff.append(file_path)
-                    
-                    subprocess.run(cmd_diff, cwd=repo.working_dir, stdout=f, check=True)
-
-                if os.path.getsize(patch_file) == 0:
-                     return None, 'No changes found'
-
-                # 2. Apply Patch
-                current_results = []
-                for target_root in target_roots:
-                    target_root = target_root.strip()
-                    if not target_root: continue
-                    if not os.path.exists(target_root):
-                        current_results.append({'target': target_root, 'status': 'error', 'message': 'Directory not found'})
-                        continue
 
-                    cmd_apply = [
-                        'git', 'apply',
-                        '-p1',
-                        '--whitespace=nowarn',
-                        '--ignore-space-change',
-                        '--ignore-whitespace',
-                        '--verbose',
-                        patch_file
-                    ]
-                    
-                    if context_lines == 0:
-                        cmd_apply.insert(2, '--unidiff-zero')
-                        
-                    if allow_reject:
-                        cmd_apply.append('--reject')
-
-                    proc = subprocess.run(cmd_apply, capture_output=True, text=True, cwd=target_root)
-                    
-                    if proc.returncode == 0:
-                        current_results.append({'target': target_root, 'status': 'success'})
-                    else:
-                        msg = proc.stderr if proc.stderr else proc.stdout
-                        
-                        # If --reject was used, and we have failure, it means some hunks failed.
-                        # We can check if .rej files were created, but git apply usually tells us.
-                        if allow_reject and 'Rejected' in msg:
-                             current_results.append({'target': target_root, 'status': 'partial', 'message': 'Partial apply. Check .rej files.'})
-                        else:
-                             current_results.append({'target': target_root, 'status': 'failed', 'message': msg})
-                
-                return patch_file, current_results
+    results = iter_sync_results(repo_path, data, file_path, target_roots, force_overwrite)
+    return _sync_response(results, target_roots, stream)
 
-            finally:
-                if os.path.exists(patch_file):
-                    os.unlink(patch_file)
+@app.route('/api/sync_commit_diff', methods=['POST'])
+def sync_commit_diff():
+    data = request.json
+    repo_path = data.get('repo_path')
+    commit_id = data.get('commit_id')
+    file_paths = data.get('file_paths') # List of paths; omit to sync every non-static file
+    target_roots = data.get('target_roots') # List of strings
+    force_overwrite = data.get('force_overwrite', False)
+    stream = data.get('stream', False) # NDJSON, one line per target as it completes
+    
+    if not repo_path or not commit_id or not target_roots:
+        return jsonify({'error': 'Missing parameters'}), 400
 
-        # First attempt: Standard context
-        _, results = try_patch_and_apply()
-        
-        final_results = []
-        failed_targets = []
-        
-        for r in results:
-            if r['status'] == 'success':
-                final_results.append(r)
-            else:
-                failed_targets.append(r['target'])
-                
-        if failed_targets:
-            # Retry failed targets with -U0
-            original_targets = target_roots
-            target_roots = failed_targets
-            
-            _, retry_results = try_patch_and_apply(context_lines=0)
-            
-            # Check if -U0 failed too
-            still_failed = []
-            for r in retry_results:
-                if r['status'] == 'success':
-                    final_results.append(r)
-                else:
-                    still_failed.append(r['target'])
-            
-            # If still failed, try --reject (Partial Apply)
-            if still_failed:
-                 target_roots = still_failed
-                 _, reject_results = try_patch_and_apply(context_lines=0, allow_reject=True)
-                 
-                 final_final_failed = []
-                 for r in reject_results:
-                     if r['status'] in ['success', 'partial']:
-                         final_results.append(r)
-                     else:
-                         final_final_failed.append(r['target'])
-                 
-                 # Force Overwrite Option
-                 if final_final_failed and force_overwrite:
-                     # Get full file content from source
-                     # We can reuse get_file_content logic or just read blob
-                     try:
-                         # Get new content blob
-                         target_diff = None
-                         if commit.parents:
-                             diffs = commit.parents[0].diff(commit)
-                         else:
-                             diffs = commit.diff(git.NULL_TREE)
-                             
-                         for d in diffs:
-                             p = d.b_path if d.b_path else d.a_path
-                             if p == file_path:
-                                 target_diff = d
-                                 break
-                         
-                         new_content = None
-                         if target_diff and target_diff.b_blob:
-                             new_content = target_diff.b_blob.data_stream.read() # Binary read
-                         
-                         if new_content is not None:
-                             for target in final_final_failed:
-                                 # Construct full path
-                                 # target is the root. file_path is relative.
-                                 # file_path might contain forward slashes. os.path.join handles it on Windows if properly split
-                                 # but file_path is from git, so forward slashes.
-                                 full_dest_path = os.path.join(target, *file_path.split('/'))
-                                 
-                                 try:
-                                     # Ensure dir exists
-                                     os.makedirs(os.path.dirname(full_dest_path), exist_ok=True)
-                                     with open(full_dest_path, 'wb') as f:
-                                         f.write(new_content)
-                                     final_results.append({'target': target, 'status': 'success', 'message': 'Forced overwrite'})
-                                 except Exception as e:
-                                     final_results.append({'target': target, 'status': 'failed', 'message': f'Overwrite failed: {e}'})
-                         else:
-                             for target in final_final_failed:
-                                 final_results.append({'target': target, 'status': 'failed', 'message': 'Could not get new content for overwrite'})
-                                 
-                     except Exception as e:
-                         for target in final_final_failed:
-                             final_results.append({'target': target, 'status': 'failed', 'message': f'Force overwrite error: {e}'})
-                 else:
-                     # Add the failure messages from reject_results for those that failed completely
-                     for r in reject_results:
-                         if r['target'] in final_final_failed:
-                             final_results.append(r)
-
-            target_roots = original_targets
-        
-        return jsonify({'results': final_results})
+    results = iter_commit_sync_results(repo_path, data, file_paths, target_roots, force_overwrite)
+    return _sync_response(results, target_roots, stream)
 
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+@app.route('/api/cache_stats', methods=['GET'])
+def get_cache_stats():
+    with _repo_pool_lock:
+        idle_handles = sum(len(idle) for idle in _repo_pool.values())
+    with _diff_index_lock:
+        indexed_commits = len(_diff_index)
+    stats = dict(cache_stats)
+    stats['repo_pool_idle'] = idle_handles
+    stats['diff_index_commits'] = indexed_commits
+    with _format_cache_lock:
+        stats['format_cache_entries'] = len(_format_cache)
+        stats['format_cache_bytes'] = _format_cache_bytes
+    return jsonify(stats)
+
+def _prometheus_labels(labels):
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    with _metrics_lock:
+        snapshot = {key: dict(m, buckets=list(m['buckets'])) for key, m in _metrics.items()}
+    lines = [
+        '# HELP text_compare_span_seconds Time spent in instrumented hot paths.',
+        '# TYPE text_compare_span_seconds histogram',
+    ]
+    for (name, labels), m in sorted(snapshot.items()):
+        labels = (('span', name),) + labels
+        cumulative = 0
+        for bound, n in zip(METRICS_BUCKETS, m['buckets']):
+            cumulative += n
+            lines.append(f"text_compare_span_seconds_bucket{_prometheus_labels(labels + (('le', bound),))} {cumulative}")
+        lines.append(f"text_compare_span_seconds_bucket{_prometheus_labels(labels + (('le', '+Inf'),))} {m['count']}")
+        lines.append(f"text_compare_span_seconds_sum{_prometheus_labels(labels)} {m['seconds']}")
+        lines.append(f"text_compare_span_seconds_count{_prometheus_labels(labels)} {m['count']}")
+    lines.append('# HELP text_compare_span_bytes_total Bytes processed by instrumented hot paths.')
+    lines.append('# TYPE text_compare_span_bytes_total counter')
+    for (name, labels), m in sorted(snapshot.items()):
+        lines.append(f"text_compare_span_bytes_total{_prometheus_labels((('span', name),) + labels)} {m['bytes']}")
+    lines.append('# HELP text_compare_cache_events_total Cache hit/miss counters (see /api/cache_stats).')
+    lines.append('# TYPE text_compare_cache_events_total counter')
+    for name, value in sorted(cache_stats.items()):
+        lines.append(f"text_compare_cache_events_total{_prometheus_labels((('event', name),))} {value}")
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
 
 @app.route('/explorer')
 def explorer():
     return render_template('explorer.html')
 
+# Directory names skipped by scan_directory unless the request passes its own
+# 'ignore' list
+SCAN_IGNORE_DIRS = {'.git', '__pycache__', 'node_modules'}
+SCAN_BATCH_SIZE = 1000
+
+def _listing_prefix(root, dir_path, split_key_lower):
+    # Output prefix for files directly in `root`, and the lowercased name of a
+    # file that must be dropped because it is the split key itself (nothing
+    # left after the key)
+    prefix = None
+    drop_name = None
+    if split_key_lower:
+        # Split path into parts to find the key safely (case insensitive)
+        path_parts = os.path.normpath(root).split(os.sep)
+        path_parts_lower = [p.lower() for p in path_parts]
+        if split_key_lower in path_parts_lower:
+            idx = path_parts_lower.index(split_key_lower)
+            prefix = path_parts[idx + 1:]
+        else:
+            drop_name = split_key_lower
+    if prefix is None:
+        rel_dir = os.path.relpath(root, dir_path)
+        prefix = [] if rel_dir == '.' else os.path.normpath(rel_dir).split(os.sep)
+    prefix = '/'.join(prefix).replace('\\', '/')
+    if prefix:
+        prefix += '/'
+    return prefix, drop_name
+
+def _list_dir(root):
+    # Returns (file names, subdirectory names) of one directory in listing
+    # order. Symlinked directories are not followed, like os.walk.
+    files = []
+    subdirs = []
+    with os.scandir(root) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if not is_dir:
+                files.append(entry.name)
+            elif not entry.is_symlink():
+                subdirs.append(entry.name)
+    return files, subdirs
+
+def iter_directory_files(dir_path, split_key=None, ignore=SCAN_IGNORE_DIRS):
+    # Yields listed file paths in os.walk order. The output path of a file
+    # only depends on its directory, so the split-key match is done once per
+    # directory instead of once per file.
+    split_key_lower = split_key.lower() if split_key else None
+    stack = [dir_path]
+    listing = 0.0 # Time spent listing, excluding the consumer
+    nbytes = 0
+    try:
+        while stack:
+            root = stack.pop()
+            start = time.perf_counter()
+            try:
+                files, subdirs = _list_dir(root)
+            except OSError:
+                continue
+            finally:
+                listing += time.perf_counter() - start
+
+            prefix, drop_name = _listing_prefix(root, dir_path, split_key_lower)
+            for name in files:
+                if drop_name is not None and name.lower() == drop_name:
+                    continue
+                path = prefix + name.replace('\\', '/')
+                nbytes += len(path)
+                yield path
+
+            # Depth-first, in listing order
+            stack.extend(os.path.join(root, d) for d in reversed(subdirs) if d not in ignore)
+    finally:
+        record_span('scan_directory', listing, nbytes)
+
+# Persistent per-directory snapshot index (sqlite). Each directory row keeps
+# its mtime and entry names, so a rescan only lists directories whose mtime
+# changed. File additions/removals are recorded per snapshot.
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', os.path.join(tempfile.gettempdir(), 'text-compare-snapshots'))
+# Directories modified this recently are re-listed on the next scan, since a
+# change within the same mtime tick would otherwise go unnoticed
+SNAPSHOT_MTIME_SLACK = 2.0
+_snapshot_locks = {}
+_snapshot_locks_lock = threading.Lock()
+
+class DirectorySnapshot:
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+        key = hashlib.sha1(_repo_key(dir_path).encode('utf-8')).hexdigest()
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        self.db_path = os.path.join(SNAPSHOT_DIR, key + '.sqlite')
+        with _snapshot_locks_lock:
+            self.lock = _snapshot_locks.setdefault(self.db_path, threading.Lock())
+        self.db = sqlite3.connect(self.db_path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS dirs (rel TEXT PRIMARY KEY, mtime_ns INTEGER, files TEXT, subdirs TEXT);
+            CREATE TABLE IF NOT EXISTS snapshots (id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL);
+            CREATE TABLE IF NOT EXISTS changes (snapshot_id INTEGER, rel TEXT, change TEXT);
+            CREATE INDEX IF NOT EXISTS changes_snapshot ON changes (snapshot_id);
+        """)
+
+    def close(self):
+        self.db.close()
+
+    def _abs(self, rel):
+        return os.path.join(self.dir_path, *rel.split('/')) if rel else self.dir_path
+
+    def latest_id(self):
+        row = self.db.execute('SELECT MAX(id) FROM snapshots').fetchone()
+        return row[0] or 0
+
+    def refresh(self, ignore=SCAN_IGNORE_DIRS):
+        # Bring the index up to date and return the current snapshot id
+        with self.lock:
+            old = {rel: (mtime_ns, files, subdirs) for rel, mtime_ns, files, subdirs
+                   in self.db.execute('SELECT rel, mtime_ns, files, subdirs FROM dirs')}
+            initial = not old
+            updates = []
+            changes = []
+            seen = set()
+            fresh_before = time.time_ns() - int(SNAPSHOT_MTIME_SLACK * 1e9)
+            stack = ['']
+            while stack:
+                rel = stack.pop()
+                try:
+                    mtime_ns = os.stat(self._abs(rel)).st_mtime_ns
+                except OSError:
+                    continue
+                seen.add(rel)
+                record = old.get(rel)
+                if record is not None and record[0] == mtime_ns:
+                    subdirs = json.loads(record[2])
+                else:
+                    try:
+                        files, subdirs = _list_dir(self._abs(rel))
+                    except OSError:
+                        seen.discard(rel)
+                        continue
+                    stored_mtime = mtime_ns if mtime_ns < fresh_before else -1
+                    updates.append((rel, stored_mtime, json.dumps(files), json.dumps(subdirs)))
+                    if not initial:
+                        old_files = set(json.loads(record[1])) if record is not None else set()
+                        new_files = set(files)
+                        changes.extend((_join_rel(rel, f), 'A') for f in new_files - old_files)
+                        changes.extend((_join_rel(rel, f), 'D') for f in old_files - new_files)
+                stack.extend(_join_rel(rel, d) for d in reversed(subdirs) if d not in ignore)
+
+            # Directories that vanished (or are now ignored) drop their files
+            removed = [rel for rel in old if rel not in seen]
+            for rel in removed:
+                changes.extend((_join_rel(rel, f), 'D') for f in json.loads(old[rel][1]))
+
+            if not updates and not removed:
+                return self.latest_id()
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)', updates)
+                self.db.executemany('DELETE FROM dirs WHERE rel = ?', [(rel,) for rel in removed])
+                # A new snapshot id only when the file set actually changed
+                if not initial and not changes:
+                    return self.latest_id()
+                snapshot_id = self.db.execute('INSERT INTO snapshots (created) VALUES (?)', (time.time(),)).lastrowid
+                self.db.executemany('INSERT INTO changes VALUES (?, ?, ?)',
+                                    [(snapshot_id, rel, change) for rel, change in changes])
+            return snapshot_id
+
+    def iter_files(self, split_key=None, ignore=SCAN_IGNORE_DIRS):
+        # Same paths and order as iter_directory_files, served from the index
+        split_key_lower = split_key.lower() if split_key else None
+        dirs = {rel: (files, subdirs) for rel, files, subdirs
+                in self.db.execute('SELECT rel, files, subdirs FROM dirs')}
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            if rel not in dirs:
+                continue
+            files, subdirs = (json.loads(v) for v in dirs[rel])
+            prefix, drop_name = _listing_prefix(self._abs(rel), self.dir_path, split_key_lower)
+            for name in files:
+                if drop_name is not None and name.lower() == drop_name:
+                    continue
+                yield prefix + name.replace('\\', '/')
+            stack.extend(_join_rel(rel, d) for d in reversed(subdirs) if d not in ignore)
+
+    def changes_since(self, snapshot_id, split_key=None):
+        # Net added/removed files between snapshot_id and the latest snapshot
+        first = {}
+        last = {}
+        for rel, change in self.db.execute(
+                'SELECT rel, change FROM changes WHERE snapshot_id > ? ORDER BY snapshot_id, rowid', (snapshot_id,)):
+            first.setdefault(rel, change)
+            last[rel] = change
+
+        split_key_lower = split_key.lower() if split_key else None
+        added = []
+        removed = []
+        for rel, change in last.items():
+            if first[rel] != change:
+                continue # Removed and re-added, or added and removed again
+            parent, _, name = rel.rpartition('/')
+            prefix, drop_name = _listing_prefix(self._abs(parent), self.dir_path, split_key_lower)
+            if drop_name is not None and name.lower() == drop_name:
+                continue
+            (added if change == 'A' else removed).append(prefix + name.replace('\\', '/'))
+        return sorted(added), sorted(removed)
+
+def _join_rel(rel, name):
+    return rel + '/' + name if rel else name
+
 @app.route('/api/scan_directory', methods=['POST'])
 def scan_directory():
     data = request.json
     dir_path = data.get('dir_path')
     split_key = data.get('split_key')
+    ignore = data.get('ignore') # Directory names to skip; defaults to SCAN_IGNORE_DIRS
+    stream = data.get('stream', False) # NDJSON batches of {'files': [...]}
+    use_snapshot = data.get('snapshot', False) # Serve from the persistent snapshot index
+    since = data.get('since') # Snapshot id: return only added/removed files since then
     
     if not dir_path:
         return jsonify({'error': 'Missing dir_path'}), 400
@@ -454,59 +2563,429 @@ def scan_directory():
         
     if not os.path.isdir(dir_path):
         return jsonify({'error': 'Path is not a directory'}), 400
+
+    ignore = SCAN_IGNORE_DIRS if ignore is None else set(ignore)
+    snapshot_id = None
+    if use_snapshot or since is not None:
+        snapshot = DirectorySnapshot(dir_path)
+        try:
+            with span('snapshot_refresh'):
+                snapshot_id = snapshot.refresh(ignore)
+            if since is not None:
+                added, removed = snapshot.changes_since(int(since), split_key)
+                return jsonify({'snapshot_id': snapshot_id, 'added': added, 'removed': removed})
+            files = list(snapshot.iter_files(split_key, ignore))
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        finally:
+            snapshot.close()
+    else:
+        files = iter_directory_files(dir_path, split_key, ignore)
+
+    if stream:
+        def generate():
+            count = 0
+            batch = []
+            try:
+                for path in files:
+                    batch.append(path)
+                    if len(batch) >= SCAN_BATCH_SIZE:
+                        yield json.dumps({'files': batch}) + '\n'
+                        count += len(batch)
+                        batch = []
+                count += len(batch)
+                if batch:
+                    yield json.dumps({'files': batch}) + '\n'
+                yield json.dumps({'done': True, 'count': count, 'snapshot_id': snapshot_id}) + '\n'
+            except Exception as e:
+                yield json.dumps({'error': str(e)}) + '\n'
+        return Response(generate(), mimetype='application/x-ndjson')
         
-    file_list = []
     try:
-        for root, dirs, files in os.walk(dir_path):
-            # Optional: Ignore .git directories to reduce noise
-            if '.git' in dirs:
-                dirs.remove('.git')
-            if '__pycache__' in dirs:
-                dirs.remove('__pycache__')
-            if 'node_modules' in dirs:
-                dirs.remove('node_modules')
-                
-            for file in files:
-                full_path = os.path.join(root, file)
-                
-                final_path = ""
-                
-                if split_key:
-                     norm_path = os.path.normpath(full_path)
-                     # Split path into parts to find the key safely
-                     path_parts = norm_path.split(os.sep)
-                     
-                     # Case insensitive search
-                     path_parts_lower = [p.lower() for p in path_parts]
-                     split_key_lower = split_key.lower()
-                     
-                     if split_key_lower in path_parts_lower:
-                         try:
-                             # Find index of the key
-                             idx = path_parts_lower.index(split_key_lower)
-                             # Reconstruct path from parts AFTER the key
-                             if idx + 1 < len(path_parts):
-                                 final_path = os.path.join(*path_parts[idx+1:])
-                             else:
-                                 final_path = "" # Should not happen for a file
-                         except ValueError:
-                             final_path = os.path.relpath(full_path, dir_path)
-                     else:
-                         final_path = os.path.relpath(full_path, dir_path)
+        result = {'files': list(files)}
+        if snapshot_id is not None:
+            result['snapshot_id'] = snapshot_id
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Compare two sides, each either a directory ({'dir_path'}) or a commit tree
+# ({'repo_path', 'commit_id'}). Directory files short-circuit on size+mtime
+# before being hashed; hashes are memoized per (path, size, mtime).
+COMPARE_HASH_WORKERS = int(os.environ.get('COMPARE_HASH_WORKERS', 8))
+FILE_HASH_CACHE_MAX = 200000
+_file_hash_cache = OrderedDict()
+_file_hash_cache_lock = threading.Lock()
+
+def _new_content_hasher():
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+def hash_file(abs_path, size, mtime_ns, kind='content'):
+    # kind 'content': fast hash for file-vs-file; 'git': git blob sha1 so the
+    # file can be compared with a tree entry (and share the format cache)
+    key = (abs_path, size, mtime_ns, kind)
+    with _file_hash_cache_lock:
+        digest = _file_hash_cache.get(key)
+        if digest is not None:
+            _file_hash_cache.move_to_end(key)
+            return digest
+
+    if kind == 'git':
+        hasher = hashlib.sha1(b'blob %d\0' % size)
+    else:
+        hasher = _new_content_hasher()
+    with open(abs_path, 'rb') as f:
+        while True:
+            chunk = f.read(BLOB_READ_CHUNK)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+
+    with _file_hash_cache_lock:
+        _file_hash_cache[key] = digest
+        while len(_file_hash_cache) > FILE_HASH_CACHE_MAX:
+            _file_hash_cache.popitem(last=False)
+    return digest
+
+def _compare_side_is_commit(spec):
+    return bool(spec.get('repo_path') and spec.get('commit_id'))
+
+def list_compare_side(spec, ignore=SCAN_IGNORE_DIRS):
+    # Returns {path: entry}; entries carry 'sha' for tree blobs and
+    # 'abs'/'size'/'mtime_ns' for directory files
+    entries = {}
+    if _compare_side_is_commit(spec):
+        with repo_handle(spec['repo_path']) as repo:
+            commit = repo.commit(spec['commit_id'])
+            output = subprocess.run(['git', 'ls-tree', '-r', '-z', commit.hexsha], cwd=repo.working_dir,
+                                    capture_output=True, check=True).stdout
+        for record in output.split(b'\0'):
+            if not record:
+                continue
+            meta, _, path = record.partition(b'\t')
+            _, obj_type, sha = meta.split(b' ')
+            path = path.decode('utf-8', 'surrogateescape')
+            if obj_type != b'blob' or any(part in ignore for part in path.split('/')[:-1]):
+                continue
+            entries[path] = {'sha': sha.decode('ascii')}
+        return entries
+
+    dir_path = spec.get('dir_path')
+    if not dir_path or not os.path.isdir(dir_path):
+        raise ValueError(f'Directory does not exist: {dir_path}')
+    for path in iter_directory_files(dir_path, None, ignore):
+        abs_path = os.path.join(dir_path, *path.split('/'))
+        try:
+            st = os.stat(abs_path)
+        except OSError:
+            continue
+        entries[path] = {'abs': abs_path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    return entries
+
+def _entry_digest(entry, kind):
+    if 'sha' in entry:
+        return entry['sha']
+    return hash_file(entry['abs'], entry['size'], entry['mtime_ns'], kind)
+
+def compare_sides(left_spec, right_spec, ignore=SCAN_IGNORE_DIRS):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        left_future = executor.submit(list_compare_side, left_spec, ignore)
+        right_future = executor.submit(list_compare_side, right_spec, ignore)
+        left, right = left_future.result(), right_future.result()
+
+    added = sorted(p for p in right if p not in left)
+    removed = sorted(p for p in left if p not in right)
+    modified = []
+    unchanged = 0
+    to_hash = []
+    for path in sorted(p for p in left if p in right):
+        l, r = left[path], right[path]
+        if 'sha' in l and 'sha' in r:
+            same = l['sha'] == r['sha']
+        elif 'sha' not in l and 'sha' not in r:
+            if l['size'] != r['size']:
+                same = False
+            elif l['mtime_ns'] == r['mtime_ns']:
+                same = True
+            else:
+                same = None
+        else:
+            same = None
+        if same is None:
+            to_hash.append(path)
+        elif same:
+            unchanged += 1
+        else:
+            modified.append(path)
+
+    def differs(path):
+        l, r = left[path], right[path]
+        kind = 'git' if ('sha' in l or 'sha' in r) else 'content'
+        return _entry_digest(l, kind) != _entry_digest(r, kind)
+
+    if to_hash:
+        with ThreadPoolExecutor(max_workers=COMPARE_HASH_WORKERS) as executor:
+            for path, changed in zip(to_hash, executor.map(differs, to_hash)):
+                if changed:
+                    modified.append(path)
                 else:
-                    # Get relative path normally
-                    final_path = os.path.relpath(full_path, dir_path)
-                
-                # Normalize path separators
-                final_path = os.path.normpath(final_path)
-                # Force forward slashes
-                final_path = final_path.replace('\\', '/')
-                if final_path and final_path != ".":
-                    file_list.append(final_path)
-                
-        return jsonify({'files': file_list})
+                    unchanged += 1
+    modified.sort()
+    return {'added': added, 'removed': removed, 'modified': modified, 'unchanged': unchanged}
+
+def read_compare_side_file(spec, file_path):
+    # Returns (blob view, blob sha) for one file on a compare side
+    if _compare_side_is_commit(spec):
+        with repo_handle(spec['repo_path']) as repo:
+            commit = repo.commit(spec['commit_id'])
+            try:
+                blob = commit.tree / file_path
+            except KeyError:
+                return make_blob_view(b'', 0), None
+            return read_blob_view(repo, blob.hexsha), blob.hexsha
+
+    abs_path = os.path.join(spec['dir_path'], *file_path.split('/'))
+    if not os.path.isfile(abs_path):
+        return make_blob_view(b'', 0), None
+    st = os.stat(abs_path)
+    with open(abs_path, 'rb') as f:
+        window = f.read(BLOB_MAX_BYTES)
+    view = make_blob_view(window, st.st_size, 0, sniff_encoding(window[:BLOB_SNIFF_BYTES]))
+    # The git blob sha lets identical content share format cache entries
+    blob_sha = None if view['truncated'] else hash_file(abs_path, st.st_size, st.st_mtime_ns, 'git')
+    return view, blob_sha
+
+@app.route('/api/compare', methods=['POST'])
+def compare():
+    data = request.json
+    left = data.get('left') or {}
+    right = data.get('right') or {}
+    ignore = data.get('ignore') # Directory names to skip; defaults to SCAN_IGNORE_DIRS
+
+    if not (left.get('dir_path') or _compare_side_is_commit(left)) or not (right.get('dir_path') or _compare_side_is_commit(right)):
+        return jsonify({'error': 'Each side needs dir_path or repo_path + commit_id'}), 400
+
+    try:
+        ignore = SCAN_IGNORE_DIRS if ignore is None else set(ignore)
+        return jsonify(compare_sides(left, right, ignore))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/compare_file_content', methods=['POST'])
+def compare_file_content():
+    data = request.json
+    left = data.get('left') or {}
+    right = data.get('right') or {}
+    file_path = data.get('file_path')
+    ignore_whitespace = data.get('ignore_whitespace', False)
+
+    if not file_path:
+        return jsonify({'error': 'Missing parameters'}), 400
+
+    try:
+        old_view, old_sha = read_compare_side_file(left, file_path)
+        new_view, new_sha = read_compare_side_file(right, file_path)
+        old_job = _start_format_view(old_view, file_path, ignore_whitespace, old_sha)
+        new_job = _start_format_view(new_view, file_path, ignore_whitespace, new_sha)
+        return jsonify({
+            'old_content': _finish_format(old_job),
+            'new_content': _finish_format(new_job),
+            'old_truncated': old_view['truncated'],
+            'new_truncated': new_view['truncated'],
+            'file_path': file_path,
+            'language': get_language_from_ext(file_path)
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Background jobs for long-running work. A job runs a generator on the job
+# pool and collects its items; clients poll /api/jobs/<id> or follow the SSE
+# stream at /api/jobs/<id>/events, and can cancel between items.
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_RETENTION = float(os.environ.get('JOB_RETENTION', 3600)) # Seconds a finished job is kept
+_jobs = {}
+_jobs_lock = threading.Lock()
+_job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+
+def _prune_jobs():
+    cutoff = time.time() - JOB_RETENTION
+    with _jobs_lock:
+        for job_id in [i for i, j in _jobs.items() if j['finished'] and j['finished'] < cutoff]:
+            del _jobs[job_id]
+
+def _run_job(job, items):
+    with job['cond']:
+        if job['status'] == 'cancelled':
+            return
+        job['status'] = 'running'
+    try:
+        for item in items:
+            with job['cond']:
+                job['results'].append(item)
+                job['progress']['done'] += len(item['files']) if job['kind'] == 'scan_directory' else 1
+                job['cond'].notify_all()
+            if job['cancel'].is_set():
+                break
+    except Exception as e:
+        with job['cond']:
+            job['error'] = str(e)
+    finally:
+        items.close()
+        with job['cond']:
+            if job['cancel'].is_set():
+                job['status'] = 'cancelled'
+            else:
+                job['status'] = 'failed' if job['error'] else 'done'
+            job['finished'] = time.time()
+            job['cond'].notify_all()
+
+def submit_job(kind, items, total=None):
+    # items: generator yielding result dicts
+    _prune_jobs()
+    job = {
+        'id': uuid.uuid4().hex,
+        'kind': kind,
+        'status': 'queued',
+        'progress': {'done': 0, 'total': total},
+        'results': [],
+        'error': None,
+        'created': time.time(),
+        'finished': None,
+        'cancel': threading.Event(),
+        'cond': threading.Condition(),
+    }
+    with _jobs_lock:
+        _jobs[job['id']] = job
+    _job_executor.submit(_run_job, job, items)
+    return job
+
+def _batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield {'files': batch}
+            batch = []
+    if batch:
+        yield {'files': batch}
+
+def _job_items(kind, params):
+    # Returns (generator, total) for a job kind, validating params up front
+    if kind == 'sync_file_diff':
+        if not all(params.get(k) for k in ('repo_path', 'commit_id', 'file_path', 'target_roots')):
+            raise ValueError('Missing parameters')
+        targets = [t for t in params['target_roots'] if t.strip()]
+        return iter_sync_results(params['repo_path'], params, params['file_path'],
+                                 targets, params.get('force_overwrite', False)), len(targets)
+    if kind == 'sync_commit_diff':
+        if not all(params.get(k) for k in ('repo_path', 'commit_id', 'target_roots')):
+            raise ValueError('Missing parameters')
+        targets = [t for t in params['target_roots'] if t.strip()]
+        return iter_commit_sync_results(params['repo_path'], params, params.get('file_paths'),
+                                        targets, params.get('force_overwrite', False)), len(targets)
+    if kind == 'scan_directory':
+        dir_path = params.get('dir_path')
+        if not dir_path or not os.path.isdir(dir_path):
+            raise ValueError('Directory does not exist')
+        ignore = SCAN_IGNORE_DIRS if params.get('ignore') is None else set(params['ignore'])
+        files = iter_directory_files(dir_path, params.get('split_key'), ignore)
+        return _batched(files, SCAN_BATCH_SIZE), None
+    if kind == 'commit_contents':
+        if not params.get('repo_path') or not params.get('commit_id'):
+            raise ValueError('Missing repo_path or commit_id')
+        file_paths = params.get('file_paths')
+        items = _stream_commit_contents(params['repo_path'], params, file_paths, params.get('ignore_whitespace', False))
+        return items, len(file_paths) if file_paths is not None else None
+    raise ValueError(f'Unknown job kind: {kind}')
+
+def _job_status(job, since=0):
+    with job['cond']:
+        return {
+            'job_id': job['id'],
+            'kind': job['kind'],
+            'status': job['status'],
+            'progress': dict(job['progress']),
+            'error': job['error'],
+            'results': job['results'][since:],
+            'next': len(job['results']),
+        }
+
+def _get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    data = request.json
+    kind = data.get('kind')
+    try:
+        items, total = _job_items(kind, data.get('params') or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    job = submit_job(kind, items, total)
+    return jsonify({'job_id': job['id']})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = _get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    # 'since' lets pollers fetch only results they have not seen yet
+    return jsonify(_job_status(job, int(request.args.get('since', 0))))
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = _get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    job['cancel'].set()
+    with job['cond']:
+        if job['status'] == 'queued':
+            job['status'] = 'cancelled'
+            job['finished'] = time.time()
+        job['cond'].notify_all()
+    return jsonify({'job_id': job_id, 'status': job['status']})
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    job = _get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    since = int(request.args.get('since', 0))
+
+    def generate():
+        # Server-sent events: one 'result' per item, 'progress' updates and a
+        # final 'end' carrying the job status
+        sent = since
+        while True:
+            with job['cond']:
+                if len(job['results']) <= sent and job['finished'] is None:
+                    job['cond'].wait(timeout=15)
+                results = job['results'][sent:]
+                progress = dict(job['progress'])
+                finished = job['finished'] is not None
+            for item in results:
+                yield f"event: result\ndata: {json.dumps(item)}\n\n"
+            sent += len(results)
+            if results:
+                yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+            elif not finished:
+                yield ": keep-alive\n\n"
+            if finished:
+                status = _job_status(job, sent)
+                status.pop('results')
+                yield f"event: end\ndata: {json.dumps(status)}\n\n"
+                return
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 if __name__ == '__main__':
+    # Warm-up starts once the server is binding; with the reloader, only the
+    # child process (WERKZEUG_RUN_MAIN) serves requests
+    if FORMAT_WARMUP and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        threading.Timer(0.5, start_warmup).start()
     app.run(debug=True, port=5000, host='0.0.0.0')
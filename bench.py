@@ -0,0 +1,260 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Benchmarks must not read or fill a shared on-disk format cache
+os.environ.pop('FORMAT_CACHE_DIR', None)
+
+import app as text_compare
+from bench_template_literals import make_bundle
+
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@example.com',
+               GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@example.com')
+
+
+def git(cwd, *args):
+    subprocess.run(['git', *args], cwd=cwd, env=GIT_ENV, check=True, capture_output=True)
+
+
+def python_source(rng, size):
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        line = (f"def func_{i}(a,b = {rng.randint(0, 99)}):\n"
+                f"    if a>b : return {{'k{i}':[a,b ,{i}]}}\n"
+                f"    return func_{max(0, i - 1)}(b,a)\n\n")
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return ''.join(lines)
+
+
+def js_source(rng, size):
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        line = (f"function f{i}(a,b){{var s=`item ${{ a.name }} of ${{ b.length }}`;"
+                f"if(a>{rng.randint(0, 99)}){{return {{k:[a,b,{i}]}}}}return s}}\n")
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return ''.join(lines)
+
+
+def modify(rng, content):
+    # Change a few lines so diffs and patches have real hunks
+    lines = content.splitlines(keepends=True)
+    for _ in range(max(1, len(lines) // 20)):
+        i = rng.randrange(len(lines))
+        comment = '//' if lines[i].startswith('function') else '#'
+        lines[i] = f"{comment} edited {i}\n" + lines[i].replace('return', 'return  ', 1)
+    return ''.join(lines)
+
+
+def make_repo(path, files, file_size, change_ratio, js_ratio, seed):
+    # Two commits: a base tree and a change touching change_ratio of the
+    # files, plus a few additions and deletions. Returns the changed paths.
+    rng = random.Random(seed)
+    os.makedirs(path)
+    git(path, 'init', '-q')
+    paths = []
+    for i in range(files):
+        ext = '.js' if rng.random() < js_ratio else '.py'
+        rel = f"pkg{i % 16}/mod{i % 7}/file{i}{ext}"
+        paths.append(rel)
+        abs_path = os.path.join(path, rel)
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        with open(abs_path, 'w') as f:
+            f.write(js_source(rng, file_size) if ext == '.js' else python_source(rng, file_size))
+    git(path, 'add', '-A')
+    git(path, 'commit', '-q', '-m', 'base')
+
+    changed = rng.sample(paths, max(1, int(files * change_ratio)))
+    for rel in changed:
+        abs_path = os.path.join(path, rel)
+        with open(abs_path) as f:
+            content = f.read()
+        with open(abs_path, 'w') as f:
+            f.write(modify(rng, content))
+    for i in range(max(1, len(changed) // 10)):
+        with open(os.path.join(path, f"pkg0/added{i}.py"), 'w') as f:
+            f.write(python_source(rng, file_size))
+    for rel in rng.sample([p for p in paths if p not in changed], min(len(changed) // 10, files - len(changed))):
+        os.remove(os.path.join(path, rel))
+    git(path, 'add', '-A')
+    git(path, 'commit', '-q', '-m', 'change')
+    return changed
+
+
+def make_tree(path, files, fanout=20):
+    # Plain directory tree for scan_directory
+    for i in range(files):
+        rel = os.path.join(f"d{i % fanout}", f"s{(i // fanout) % fanout}", f"f{i}.txt")
+        abs_path = os.path.join(path, rel)
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        open(abs_path, 'w').close()
+
+
+def clear_caches():
+    with text_compare._diff_index_lock:
+        text_compare._diff_index.clear()
+    with text_compare._format_cache_lock:
+        text_compare._format_cache.clear()
+        text_compare._format_cache_bytes = 0
+
+
+def summarize(samples, nbytes=0):
+    samples = sorted(samples)
+    total = sum(samples)
+    result = {
+        'n': len(samples),
+        'total_s': total,
+        'mean_ms': statistics.mean(samples) * 1000,
+        'p50_ms': samples[len(samples) // 2] * 1000,
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+        'ops_per_s': len(samples) / total if total else None,
+    }
+    if nbytes:
+        result['mb_per_s'] = nbytes * len(samples) / total / 1e6 if total else None
+    return result
+
+
+def measure(fn, iterations, setup=None, nbytes=0):
+    samples = []
+    for i in range(iterations):
+        if setup is not None:
+            setup(i)
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples, nbytes)
+
+
+def post(client, url, payload):
+    response = client.post(url, json=payload)
+    if response.status_code != 200:
+        raise RuntimeError(f"{url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='text-compare-bench-', dir=args.workdir)
+    client = text_compare.app.test_client()
+    results = {}
+    try:
+        repo = os.path.join(workdir, 'repo')
+        changed = make_repo(repo, args.files, args.file_size, args.change_ratio, args.js_ratio, args.seed)
+        rng = random.Random(args.seed)
+        diff_request = {'repo_path': repo, 'commit_id': 'HEAD'}
+        # Start the format pool up front: "cold" means empty caches, not process spawn
+        text_compare.format_code(python_source(rng, 100), 'warmup.py')
+
+        results['get_diff_files_cold'] = measure(
+            lambda i: post(client, '/api/get_diff_files', diff_request), args.iterations,
+            setup=lambda i: clear_caches())
+        results['get_diff_files_warm'] = measure(
+            lambda i: post(client, '/api/get_diff_files', diff_request), args.iterations)
+
+        picks = [rng.choice(changed) for _ in range(args.iterations)]
+        content_request = lambda i: post(client, '/api/get_file_content', dict(diff_request, file_path=picks[i]))
+        results['get_file_content_cold'] = measure(content_request, args.iterations, setup=lambda i: clear_caches(),
+                                                   nbytes=args.file_size * 2)
+        for i in range(args.iterations):
+            content_request(i) # Prime the diff index and format cache
+        results['get_file_content_warm'] = measure(content_request, args.iterations, nbytes=args.file_size * 2)
+
+        # Formatter latency without the format cache (no blob sha)
+        samples = {
+            'python': ('.py', python_source(rng, args.file_size)),
+            'javascript': ('.js', js_source(rng, args.file_size)),
+            'json': ('.json', json.dumps([{'k': i, 'v': [i, str(i)]} for i in range(args.file_size // 24)])),
+            'css': ('.css', ''.join(f".c{i}{{color:#{i % 999:03d};margin:0 {i}px}}" for i in range(args.file_size // 32))),
+            # jsbeautifier fails on some single-line markup; keep the sample on the formatting path
+            'html': ('.html', '<ul>\n' + ''.join(f"  <li class=\"r{i}\"><a href=\"#{i}\">{i}</a></li>\n"
+                                                for i in range(args.file_size // 40)) + '</ul>\n'),
+        }
+        for language, (ext, content) in samples.items():
+            results[f'format_code_{language}'] = measure(
+                lambda i: text_compare.format_code(content, 'sample' + ext), args.iterations, nbytes=len(content))
+
+        bundle = make_bundle(args.bundle_size)
+        results['normalize_template_literals'] = measure(
+            lambda i: text_compare.normalize_template_literals(bundle), args.iterations, nbytes=len(bundle))
+
+        # Multi-target sync: every target starts at the base commit
+        targets = []
+        for t in range(args.targets):
+            target = os.path.join(workdir, f'target{t}')
+            git(workdir, 'clone', '-q', repo, target)
+            git(target, 'checkout', '-q', 'HEAD~1')
+            targets.append(target)
+
+        def reset_targets(i):
+            for target in targets:
+                git(target, 'checkout', '-q', '--', '.')
+                git(target, 'clean', '-q', '-fd')
+
+        results['sync_file_diff'] = measure(
+            lambda i: post(client, '/api/sync_file_diff', dict(diff_request, file_path=picks[i], target_roots=targets)),
+            args.iterations, setup=reset_targets)
+        results['sync_file_diff']['targets'] = len(targets)
+
+        tree = os.path.join(workdir, 'tree')
+        make_tree(tree, args.scan_files)
+        results['scan_directory'] = measure(
+            lambda i: post(client, '/api/scan_directory', {'dir_path': tree}), args.iterations)
+        results['scan_directory']['files'] = args.scan_files
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    try:
+        version = subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        version = None
+    return {
+        'version': version,
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': vars(args),
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the diff, format, sync and scan paths on synthetic repos.')
+    parser.add_argument('--files', type=int, default=500, help='Files in the synthetic repo')
+    parser.add_argument('--file-size', type=int, default=8192, help='Approximate bytes per file')
+    parser.add_argument('--change-ratio', type=float, default=0.2, help='Fraction of files modified by the head commit')
+    parser.add_argument('--js-ratio', type=float, default=0.5, help='Fraction of JS files (the rest are Python)')
+    parser.add_argument('--targets', type=int, default=4, help='Sync target checkouts')
+    parser.add_argument('--scan-files', type=int, default=20000, help='Files in the scan_directory tree')
+    parser.add_argument('--bundle-size', type=int, default=1_000_000, help='Bytes of JS for normalize_template_literals')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--workdir', default=None, help='Where to create the synthetic repos (default: temp dir)')
+    parser.add_argument('--output', default=None, help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import random
+import sys
+import time
+
+from app import normalize_template_literals
+
+
+def reference_normalize_template_literals(content):
+    # Original character-by-character implementation, kept as the reference
+    # the rewrite in app.py must match byte for byte.
+    result = []
+    i = 0
+    n = len(content)
+    while i < n:
+        if content[i:i+2] == '${':
+            result.append('${')
+            i += 2
+            while i < n and content[i].isspace():
+                i += 1
+            start_expr = i
+            brace_count = 1
+            in_string = False
+            string_char = None
+            while i < n and brace_count > 0:
+                char = content[i]
+                if in_string:
+                    if char == string_char:
+                        escaped = False
+                        k = i - 1
+                        while k >= start_expr and content[k] == '\\':
+                            escaped = not escaped
+                            k -= 1
+                        if not escaped:
+                            in_string = False
+                else:
+                    if char == '"' or char == "'" or char == '`':
+                        in_string = True
+                        string_char = char
+                    elif char == '{':
+                        brace_count += 1
+                    elif char == '}':
+                        brace_count -= 1
+                        if brace_count == 0:
+                            expr = content[start_expr:i]
+                            expr = expr.rstrip()
+                            result.append(expr)
+                            result.append('}')
+                            i += 1
+                            break
+                i += 1
+        else:
+            result.append(content[i])
+            i += 1
+    return "".join(result)
+
+
+CORPUS = [
+    '',
+    'no templates here',
+    '`a ${ b } c`',
+    '`a ${b}${ c }d`',
+    '`${  {a: 1}  }`',
+    '`outer ${ `inner ${ x } text` } end`',
+    '`${ "}" + \'{\' }`',
+    '`${ "a\\"}" }`',
+    '`${ "a\\\\" } tail`',
+    '`${ \'\\\\\\\'\' }`',
+    '`${ fn({a: {b: 1}}) }`',
+    '`unclosed ${ a + b',
+    '`unclosed string ${ "abc }',
+    '`${ \\"x" }`',
+    '${',
+    '${}',
+    '${ }',
+    '$${ a }$',
+    '"plain ${ str }"',
+    '`${\n\t a \n}`',
+    '`${ a }`',
+    'trailing backslash ${ "\\',
+]
+
+_PIECES = ['${', '${ ', '}', '{', ' ', '\n', '"', "'", '`', '\\', 'a', 'foo', '$', '\\\\']
+
+
+def random_case(rng, length):
+    return ''.join(rng.choice(_PIECES) for _ in range(length))
+
+
+def check_equivalence(cases=20000, seed=1234):
+    rng = random.Random(seed)
+    inputs = list(CORPUS) + [random_case(rng, rng.randint(1, 40)) for _ in range(cases)]
+    for text in inputs:
+        expected = reference_normalize_template_literals(text)
+        actual = normalize_template_literals(text)
+        if expected != actual:
+            print(f"MISMATCH for {text!r}:\n  expected {expected!r}\n  actual   {actual!r}")
+            return False
+    print(f"Equivalent on {len(inputs)} inputs")
+    return True
+
+
+def make_bundle(size):
+    # Minified-looking JS: mostly plain code with templates and escape-heavy strings
+    chunks = [
+        'function a(b,c){return b+c}',
+        'var s=`row ${ item.name } of ${ list.length }`;',
+        'var e="\\\\\\\\\\\\\\\\\\"";',
+        'el.innerHTML=`<div class="${ cls }">${ fmt("\\\\\\\\\\\\}") }</div>`;',
+        'x={a:{b:[1,2,3]}};',
+    ]
+    parts = []
+    total = 0
+    i = 0
+    while total < size:
+        chunk = chunks[i % len(chunks)]
+        parts.append(chunk)
+        total += len(chunk)
+        i += 1
+    return ''.join(parts)
+
+
+def time_call(fn, text, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench(sizes=(1_000_000, 5_000_000)):
+    for size in sizes:
+        text = make_bundle(size)
+        old = time_call(reference_normalize_template_literals, text)
+        new = time_call(normalize_template_literals, text)
+        print(f"{size / 1e6:.0f} MB bundle: reference {old:.3f}s, current {new:.3f}s, speedup {old / new:.1f}x")
+
+    # Escaped quotes after long runs of backslashes were quadratic
+    text = '`${ "' + ('\\' * 2000 + '\\"') * 200 + '" }`'
+    old = time_call(reference_normalize_template_literals, text, repeat=1)
+    new = time_call(normalize_template_literals, text, repeat=1)
+    print(f"Escape-heavy string: reference {old:.3f}s, current {new:.3f}s, speedup {old / new:.1f}x")
+
+
+if __name__ == '__main__':
+    if not check_equivalence():
+        sys.exit(1)
+    bench()
@@ -0,0 +1,26 @@
+// Long-lived prettier worker for FORMAT_DAEMONS in app.py. Reads one JSON
+// request per line on stdin ({id, content, ext, ignore_newline}) and writes
+// one JSON reply per line ({id, formatted} or {id, error}).
+const readline = require('readline');
+const prettier = require('prettier');
+
+const rl = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+let queue = Promise.resolve();
+
+rl.on('line', line => {
+    // Replies must stay in request order, so requests are chained
+    queue = queue.then(async () => {
+        let request;
+        try {
+            request = JSON.parse(line);
+            const formatted = await prettier.format(request.content, {
+                filepath: 'file' + request.ext,
+                tabWidth: 4,
+                printWidth: request.ignore_newline ? 10000 : 100
+            });
+            process.stdout.write(JSON.stringify({ id: request.id, formatted }) + '\n');
+        } catch (err) {
+            process.stdout.write(JSON.stringify({ id: request ? request.id : null, error: String(err) }) + '\n');
+        }
+    });
+});